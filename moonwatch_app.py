@@ -0,0 +1,86 @@
+'''
+Runs the whole Moonwatch beast in one process: the Slack app and the Twitter bot share one scheduler, one event loop
+and one data layer (price checks, local store, Google Sheets client), so one price fetch feeds every channel
+Jobs can be coroutines (they run on the event loop and can do their I/O concurrently) or plain functions (they run on the loop's thread pool)
+'''
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from apscheduler.schedulers.asyncio import AsyncIOScheduler
+from apscheduler.triggers.cron import CronTrigger
+
+import moonwatch_utils as moon
+import slack_app
+import twitter_bot
+
+# Threads for the plain function jobs, and for the blocking clients the coroutine jobs wrap with asyncio.to_thread
+MAX_WORKERS = 10
+
+# Every channel knows how to add its own jobs to the scheduler
+CHANNELS = {
+    'slack': slack_app.registerJobs,
+    'twitter': twitter_bot.registerJobs,
+}
+
+def registerDataJobs(scheduler):
+    '''
+    Adds the jobs every channel relies on: price checks (which publish the price events the channels subscribe to),
+    historical data & the Google Sheets mirror
+    '''
+
+    # Uncomment to run tasks manually on re-deploy (aka testing in prod lol)
+    #moon.updateHistoricalData()
+
+    # Once, as soon as the scheduler starts (on the thread pool, not the event loop): catch up on historical data
+    # if the store is behind, e.g. after a deploy wiped the database
+    scheduler.add_job(moon.catchUpHistoricalData, 'date')
+
+    # Price check (for the whole watchlist) during trading hours
+    # Runs every 5 minutes, but only spends an API call as often as the monthly budget allows (faster on volatile days)
+    # The quote fetch and the last price lookups run at the same time
+    scheduler.add_job(moon.updateStonkxDataAsync, CronTrigger.from_crontab('*/5 * * * *'), args=None)
+    # Update historical data (for the whole watchlist) after market close, in time for the EOD summaries
+    scheduler.add_job(moon.updateHistoricalData, CronTrigger.from_crontab('2 20 * * mon-thu'), args=None)
+    # On Fridays, rewrite the whole year instead, to pick up adjclose revisions (splits, dividends). Same API cost as the daily update
+    scheduler.add_job(moon.updateHistoricalData, CronTrigger.from_crontab('2 20 * * fri'), kwargs={'full_refresh': True})
+    # Copy new rows from the local store to the Google Sheets tabs
+    scheduler.add_job(moon.mirrorStoreToGoogleSheets, CronTrigger.from_crontab('*/2 * * * *'), args=None)
+
+async def run(channels):
+    '''
+    Registers the shared data jobs and the jobs of every channel on one scheduler, and runs it on this event loop until we're stopped
+    '''
+
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix='moonwatch_jobs'))
+
+    scheduler = AsyncIOScheduler(event_loop=loop)
+    registerDataJobs(scheduler)
+    for channel in channels:
+        print(f"Registering {channel} jobs")
+        CHANNELS[channel](scheduler)
+
+    scheduler.start()
+    try:
+        # The scheduler does its thing on the loop, we just wait here until the process is stopped
+        await asyncio.Event().wait()
+    finally:
+        scheduler.shutdown()
+
+def main(channels=None):
+    '''
+    Runs the shared data jobs and the jobs of every channel (MOONWATCH_CHANNELS, default all of them) until we're stopped
+    '''
+
+    if channels is None:
+        channels = [x.strip() for x in os.getenv("MOONWATCH_CHANNELS", ",".join(CHANNELS)).split(",") if x.strip()]
+
+    # Let 'er rip (this blocks the main thread until the process is stopped)
+    try:
+        asyncio.run(run(channels))
+    except (KeyboardInterrupt, SystemExit):
+        pass
+
+if __name__ == "__main__":
+    main()
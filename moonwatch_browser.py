@@ -0,0 +1,214 @@
+'''
+A pool of warm headless Chrome sessions for grabbing screenshots
+Starting Chrome is the slow part, so sessions are kept alive between jobs and handed out one job at a time.
+A session is thrown away (with driver.quit(), so no chromedriver processes are left behind) after MAX_USES jobs,
+when it grows past MAX_RSS_MB of memory, or when the session itself breaks (a slow or odd page doesn't count)
+'''
+
+import atexit
+import os
+import threading
+from contextlib import contextmanager
+
+from selenium import webdriver
+from selenium.common.exceptions import (InvalidSelectorException, JavascriptException, NoSuchElementException,
+                                        StaleElementReferenceException, TimeoutException, WebDriverException)
+from urllib3.exceptions import HTTPError as Urllib3HTTPError
+from selenium.webdriver.chrome.options import Options
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH', '/usr/local/bin/chromedriver')
+GOOGLE_CHROME_BIN = os.environ.get('GOOGLE_CHROME_BIN', '/usr/bin/google-chrome')
+
+# Heroku dynos don't have a lot of memory, so by default there's one session and it gets recycled fairly often
+POOL_SIZE = int(os.getenv("BROWSER_POOL_SIZE", 1))
+MAX_USES = int(os.getenv("BROWSER_MAX_USES", 20))
+MAX_RSS_MB = int(os.getenv("BROWSER_MAX_RSS_MB", 350))
+BORROW_TIMEOUT_SECONDS = 120
+
+# The stock chart on Google's search results page, and how long to wait for it before giving up
+CHART_SELECTOR = os.getenv("GOOGLE_CHART_SELECTOR", "#knowledge-finance-wholepage__entity-summary")
+CHART_WAIT_SECONDS = int(os.getenv("GOOGLE_CHART_WAIT_SECONDS", 10))
+
+# Errors about the page (slow to load, not what we expected), not the browser - the session is still good after these
+PAGE_ERRORS = (TimeoutException, NoSuchElementException, StaleElementReferenceException, InvalidSelectorException, JavascriptException)
+
+
+"""
+------------------------------------
+SESSIONS
+------------------------------------
+"""
+def createDriver():
+
+    options = Options()
+    options.binary_location = GOOGLE_CHROME_BIN
+    options.add_argument('--disable-gpu')
+    options.add_argument('--no-sandbox')
+    options.add_argument("--window-size=1920,1080")
+    options.headless = True
+
+    driver = webdriver.Chrome(executable_path=CHROMEDRIVER_PATH , chrome_options=options)
+    print("WOW the driver works")
+
+    return driver
+
+def getProcessTreeRSSMB(pid):
+    '''
+    Returns the memory (RSS, in MB) used by a process and all of its children (chromedriver -> chrome -> renderers...),
+    or None if we can't tell (no /proc on this machine)
+    '''
+
+    try:
+        parents = dict()
+        for entry in os.listdir('/proc'):
+            if entry.isdigit():
+                try:
+                    with open(f'/proc/{entry}/stat') as f:
+                        parents[int(entry)] = int(f.read().rsplit(')', 1)[1].split()[1])
+                except (OSError, IndexError, ValueError):
+                    continue
+
+        tree = {pid}
+        grew = True
+        while grew:
+            children = {child for child, parent in parents.items() if parent in tree and child not in tree}
+            tree |= children
+            grew = len(children) > 0
+
+        rss_kb = 0
+        for process in tree:
+            try:
+                with open(f'/proc/{process}/status') as f:
+                    rss_kb += sum(int(line.split()[1]) for line in f if line.startswith('VmRSS:'))
+            except OSError:
+                continue
+
+        return rss_kb / 1024
+
+    except OSError:
+        return None
+
+class BrowserSession:
+    '''
+    One warm Chrome, plus how many times it's been used
+    '''
+
+    def __init__(self):
+        self.driver = createDriver()
+        self.uses = 0
+
+    def getMemoryMB(self):
+        try:
+            return getProcessTreeRSSMB(self.driver.service.process.pid)
+        except AttributeError:
+            return None
+
+    def isWornOut(self):
+        if self.uses >= MAX_USES:
+            print(f"Browser session has been used {self.uses} times - recycling it")
+            return True
+
+        memory = self.getMemoryMB()
+        if memory is not None and memory > MAX_RSS_MB:
+            print(f"Browser session is using {round(memory)}MB - recycling it")
+            return True
+
+        return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except WebDriverException as e:
+            print(f"Browser session didn't quit cleanly: {e}")
+
+
+def isSessionBroken(e):
+    '''
+    True if this exception (raised while a job had the session) means the session can't be used again: Chrome or chromedriver
+    crashed, went away or lost the session. Page-level errors (PAGE_ERRORS) and bugs in the job itself don't
+    '''
+
+    if isinstance(e, WebDriverException):
+        return not isinstance(e, PAGE_ERRORS)
+
+    # Can't even talk to chromedriver anymore
+    return isinstance(e, (ConnectionError, Urllib3HTTPError))
+
+
+"""
+------------------------------------
+POOL
+------------------------------------
+"""
+class BrowserPool:
+    '''
+    Hands out up to {size} Chrome sessions at a time. Jobs that ask for one while they're all busy wait their turn
+    '''
+
+    def __init__(self, size=POOL_SIZE):
+        self._available = threading.BoundedSemaphore(size)
+        self._lock = threading.Lock()
+        self._idle = []
+        self._closed = False
+
+    @contextmanager
+    def borrow(self, timeout=BORROW_TIMEOUT_SECONDS):
+        '''
+        with browser_pool.borrow() as driver: ...
+        The session goes back in the pool when the block exits, or gets quit if it's worn out or broken (see isSessionBroken)
+        '''
+
+        if not self._available.acquire(timeout=timeout):
+            raise TimeoutError(f"No browser session became free within {timeout} seconds")
+
+        session = None
+        healthy = False
+        try:
+            with self._lock:
+                if self._closed:
+                    raise RuntimeError("The browser pool has been shut down")
+                session = self._idle.pop() if self._idle else None
+
+            if session is None:
+                print("Starting a new browser session")
+                session = BrowserSession()
+
+            session.uses += 1
+            try:
+                yield session.driver
+            except Exception as e:
+                healthy = not isSessionBroken(e)
+                raise
+            healthy = True
+
+        finally:
+            if session is not None:
+                with self._lock:
+                    keep = healthy and not self._closed and not session.isWornOut()
+                    if keep:
+                        self._idle.append(session)
+                if not keep:
+                    session.quit()
+            self._available.release()
+
+    def shutdown(self):
+        '''
+        Quits every idle session. Sessions that are out on loan get quit when they come back
+        '''
+
+        with self._lock:
+            self._closed = True
+            idle, self._idle = self._idle, []
+
+        for session in idle:
+            session.quit()
+
+browser_pool = BrowserPool()
+
+# Never leave Chrome processes behind when the app stops
+atexit.register(browser_pool.shutdown)
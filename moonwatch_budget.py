@@ -0,0 +1,272 @@
+'''
+Keeps track of how many RapidAPI (Yahoo! Finance) calls we have made this month, and how fast we can afford to make more.
+RapidAPI gives us 500 free calls per month, shared by every process that uses the same API key.
+Our own ledger lives in the local SQLite file, which doesn't survive a dyno restart and isn't seen by other dynos,
+so it's checked against the quota RapidAPI reports back on every response (x-ratelimit-requests-remaining), which is always right
+'''
+
+import hashlib
+import os
+from datetime import datetime, timedelta
+
+import moonwatch_store as store
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+MONTHLY_QUOTA = int(os.getenv("RAPIDAPI_MONTHLY_QUOTA", 500))
+# Calls per trading day kept aside for jobs that don't poll (the historical data refresh after market close costs one per ticker)
+RESERVED_CALLS_PER_DAY = int(os.getenv("RAPIDAPI_RESERVED_CALLS_PER_DAY", len(os.getenv("MOONWATCH_WATCHLIST", "GME").split(","))))
+
+# Never poll faster than this, no matter how much budget is left - or slower than this, no matter how little
+MIN_POLL_MINUTES = 5
+MAX_POLL_MINUTES = 120
+
+# A day is "volatile" if a ticker has moved at least this much (%) since the prior close, and "quiet" if it has moved less than this
+VOLATILE_CHANGE_PERCENT = 3.0
+QUIET_CHANGE_PERCENT = 0.5
+
+QUOTES_ENDPOINT = "market/v2/get-quotes"
+
+# Trading hours in UTC, same as moonwatch_utils.checkIfTradingHours
+MARKET_OPEN = (13, 30)
+MARKET_CLOSE = (20, 2)
+
+
+"""
+------------------------------------
+CALL LEDGER
+------------------------------------
+"""
+def getApiKeyId():
+    '''
+    Returns a short fingerprint of the RapidAPI key, so the ledger can tell keys apart without storing the key itself
+    '''
+
+    return hashlib.sha256(os.environ['RAPIDAPI_KEY'].encode()).hexdigest()[:12]
+
+def recordRapidApiCall(endpoint):
+    '''
+    Call this every time we hit RapidAPI (including retries - they count against the quota too)
+    '''
+
+    store.recordApiCall(getApiKeyId(), endpoint, datetime.now())
+
+def getStartOfMonth(now=None):
+    now = now or datetime.now()
+    return datetime(now.year, now.month, 1)
+
+def getStartOfNextMonth(now=None):
+    now = now or datetime.now()
+    return datetime(now.year + now.month // 12, now.month % 12 + 1, 1)
+
+def getCallsThisMonth():
+    '''
+    Returns how many calls we've used this month: what our ledger counts, or what RapidAPI last told us (plus the calls since), whichever is more
+    '''
+
+    ledger_calls = store.countApiCalls(getApiKeyId(), getStartOfMonth())
+    reported_remaining = getReportedRemainingQuota()
+    if reported_remaining is None:
+        return ledger_calls
+
+    return max(ledger_calls, getMonthlyQuota() - reported_remaining)
+
+def getRemainingQuota():
+    return max(getMonthlyQuota() - getCallsThisMonth(), 0)
+
+
+"""
+------------------------------------
+RAPIDAPI'S OWN COUNT
+------------------------------------
+"""
+def recordQuotaHeaders(headers):
+    '''
+    Call this with the headers of every RapidAPI response. Remembers the quota RapidAPI says we have left,
+    so the budget stays right after a restart wipes the ledger (or when another process spends from the same key)
+    '''
+
+    remaining = headers.get('x-ratelimit-requests-remaining')
+    if remaining is None or not str(remaining).isdigit():
+        return
+
+    limit = headers.get('x-ratelimit-requests-limit')
+    store.setStoreValue("rapidapi_reported_quota", {
+        'remaining': int(remaining),
+        'limit': int(limit) if limit is not None and str(limit).isdigit() else None,
+        'reported_at': datetime.now().isoformat()
+    })
+
+def getReportedQuota():
+    '''
+    Returns the last quota report from RapidAPI if it's from this month, or None
+    '''
+
+    reported = store.getStoreValue("rapidapi_reported_quota")
+    if reported is None or datetime.fromisoformat(reported['reported_at']) < getStartOfMonth():
+        return None
+
+    return reported
+
+def getMonthlyQuota():
+    '''
+    Our plan's monthly quota, as RapidAPI reports it (falls back to RAPIDAPI_MONTHLY_QUOTA until we've seen a response)
+    '''
+
+    reported = getReportedQuota()
+    if reported is None or reported['limit'] is None:
+        return MONTHLY_QUOTA
+
+    return reported['limit']
+
+def getReportedRemainingQuota():
+    '''
+    Returns what RapidAPI last said we had left, minus the calls we've made since, or None if it hasn't told us anything this month
+    '''
+
+    reported = getReportedQuota()
+    if reported is None:
+        return None
+
+    calls_since = store.countApiCalls(getApiKeyId(), datetime.fromisoformat(reported['reported_at']))
+    return max(reported['remaining'] - calls_since, 0)
+
+
+"""
+------------------------------------
+TRADING CALENDAR MATH
+------------------------------------
+"""
+def getTradingMinutesBetween(start, end):
+    '''
+    Returns the number of minutes between start and end that fall within trading hours (weekdays only, no holiday calendar)
+    '''
+
+    minutes = 0
+    day = start.date()
+    while day <= end.date():
+        if day.weekday() < 5:
+            market_open = datetime(day.year, day.month, day.day, *MARKET_OPEN)
+            market_close = datetime(day.year, day.month, day.day, *MARKET_CLOSE)
+            overlap = min(end, market_close) - max(start, market_open)
+            minutes += max(overlap.total_seconds() / 60, 0)
+        day += timedelta(days=1)
+
+    return minutes
+
+def getTradingDaysBetween(start, end):
+    return sum(1 for i in range((end.date() - start.date()).days + 1) if (start.date() + timedelta(days=i)).weekday() < 5)
+
+def addTradingMinutes(start, minutes):
+    '''
+    Returns the datetime that is {minutes} trading minutes after start
+    '''
+
+    current = start
+    while True:
+        market_open = datetime(current.year, current.month, current.day, *MARKET_OPEN)
+        market_close = datetime(current.year, current.month, current.day, *MARKET_CLOSE)
+        if current.weekday() < 5 and current < market_close:
+            current = max(current, market_open)
+            available = (market_close - current).total_seconds() / 60
+            if minutes <= available:
+                return current + timedelta(minutes=minutes)
+            minutes -= available
+        current = datetime(current.year, current.month, current.day) + timedelta(days=1)
+
+
+"""
+------------------------------------
+BUDGET PLANNER
+------------------------------------
+"""
+def getPollingInterval(change_percent=None):
+    '''
+    Returns how many minutes we should wait between price checks so the remaining budget lasts until the end of the month.
+    The remaining calls (minus what's reserved for other jobs) are spread evenly over the remaining trading minutes,
+    then we check twice as often on volatile days and half as often on quiet ones.
+    change_percent is the biggest move (%) on the watchlist since the prior close, if we know it
+    '''
+
+    now = datetime.now()
+    month_end = getStartOfNextMonth(now)
+    trading_minutes_left = getTradingMinutesBetween(now, month_end)
+    reserved_calls = RESERVED_CALLS_PER_DAY * getTradingDaysBetween(now, month_end - timedelta(days=1))
+    calls_left = getRemainingQuota() - reserved_calls
+
+    if calls_left <= 0:
+        return MAX_POLL_MINUTES
+
+    interval = trading_minutes_left / calls_left
+
+    if change_percent is not None:
+        if abs(change_percent) >= VOLATILE_CHANGE_PERCENT:
+            interval = interval / 2
+        elif abs(change_percent) < QUIET_CHANGE_PERCENT:
+            interval = interval * 2
+
+    return min(max(interval, MIN_POLL_MINUTES), MAX_POLL_MINUTES)
+
+def shouldPollNow():
+    '''
+    Returns True if enough time has passed since the last price check (by any process) to afford another one.
+    Uses the move recorded at the last check to decide how volatile the day is
+    '''
+
+    if getRemainingQuota() == 0:
+        print("RapidAPI quota is used up for this month :( no more price checks until next month")
+        return False
+
+    last_call = store.getLastApiCallTime(getApiKeyId(), QUOTES_ENDPOINT)
+    if last_call is None:
+        return True
+
+    last_change = store.getStoreValue("last_quote_change_percent")
+    interval = getPollingInterval(last_change)
+    minutes_since_last_call = (datetime.now() - datetime.fromisoformat(last_call)).total_seconds() / 60
+    if minutes_since_last_call < interval:
+        print(f"Last price check was {round(minutes_since_last_call)} minutes ago, next one is due after {round(interval)} minutes")
+        return False
+
+    return True
+
+def recordQuoteChange(change_percent):
+    '''
+    Remembers how much the watchlist moved at the last price check, so the planner knows if today is volatile or quiet
+    '''
+
+    store.setStoreValue("last_quote_change_percent", change_percent)
+
+def getProjectedExhaustionDate():
+    '''
+    Returns the date we will run out of calls if we keep spending at this month's rate, or None if we're on track to make it to next month
+    '''
+
+    now = datetime.now()
+    calls_this_month = getCallsThisMonth()
+    trading_minutes_so_far = getTradingMinutesBetween(getStartOfMonth(now), now)
+    if calls_this_month == 0 or trading_minutes_so_far == 0:
+        return None
+
+    calls_per_minute = calls_this_month / trading_minutes_so_far
+    exhaustion = addTradingMinutes(now, getRemainingQuota() / calls_per_minute)
+    if exhaustion >= getStartOfNextMonth(now):
+        return None
+
+    return exhaustion.date()
+
+def getBudgetStatus():
+    '''
+    Returns a dict summarizing where we are with the monthly quota
+    '''
+
+    return {
+        'quota': getMonthlyQuota(),
+        'used': getCallsThisMonth(),
+        'remaining': getRemainingQuota(),
+        'polling_interval_minutes': round(getPollingInterval(store.getStoreValue("last_quote_change_percent")), 1),
+        'projected_exhaustion_date': getProjectedExhaustionDate()
+    }
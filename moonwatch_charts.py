@@ -0,0 +1,159 @@
+'''
+Trend charts drawn straight from our own data (price ticks & daily history in the local store) with PIL
+No browser, no Google, no sleeping and no crop coordinates - works for any ticker and any window we have data for
+'''
+
+from datetime import datetime, timedelta
+
+from PIL import Image, ImageDraw, ImageFont
+
+import moonwatch_store as store
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+# Same size as the old cropped Google screenshot
+CHART_WIDTH = 645
+CHART_HEIGHT = 340
+MARGIN_LEFT = 16
+MARGIN_RIGHT = 64
+MARGIN_TOP = 56
+MARGIN_BOTTOM = 28
+
+BACKGROUND_COLOR = (255, 255, 255)
+TEXT_COLOR = (32, 33, 36)
+MUTED_COLOR = (112, 117, 122)
+GRID_COLOR = (232, 234, 237)
+UP_COLOR = (19, 115, 51)
+DOWN_COLOR = (197, 34, 31)
+
+# window: (where the data comes from, how many days back)
+WINDOWS = {
+    '1d': ('ticks', 1),
+    '5d': ('ticks', 5),
+    '1m': ('daily', 30),
+    '6m': ('daily', 182),
+    '1y': ('daily', 365),
+}
+
+class NotEnoughDataError(Exception):
+    '''
+    Raised when the store doesn't have at least two points to draw a line between
+    '''
+    pass
+
+
+"""
+------------------------------------
+DATA
+------------------------------------
+"""
+def getChartData(ticker, window, end=None):
+    '''
+    Returns (timestamps, prices, reference_price) for the chart. The reference price is what the change is measured against:
+    the prior close for intraday windows, the first close for the daily ones
+    '''
+
+    source, days = WINDOWS[window]
+    end = end or datetime.now()
+
+    if source == 'ticks':
+        start = datetime(end.year, end.month, end.day) - timedelta(days=days-1)
+        ticks_df = store.getTicks(ticker, start=start, end=end)
+        timestamps = [datetime.fromisoformat(x) for x in ticks_df['Timestamp']]
+        prices = list(ticks_df['Price'])
+        prior_days_df = store.getDailyBars([ticker], end_date=str(start.date() - timedelta(days=1)))
+        reference_price = prior_days_df['close'].iloc[-1] if len(prior_days_df) > 0 else (prices[0] if prices else None)
+    else:
+        daily_df = store.getDailyBars([ticker], start_date=str((end - timedelta(days=days)).date()), end_date=str(end.date()))
+        timestamps = [datetime.strptime(x, "%Y-%m-%d") for x in daily_df['Date']] if len(daily_df) > 0 else []
+        prices = list(daily_df['close']) if len(daily_df) > 0 else []
+        reference_price = prices[0] if prices else None
+
+    if len(prices) < 2:
+        raise NotEnoughDataError(f"Only {len(prices)} {source} points for {ticker} in the last {window}")
+
+    return timestamps, prices, reference_price
+
+
+"""
+------------------------------------
+DRAWING
+------------------------------------
+"""
+def formatTimeLabel(timestamp, window):
+    if WINDOWS[window][0] == 'ticks' and WINDOWS[window][1] == 1:
+        return timestamp.strftime('%H:%M')
+    return timestamp.strftime('%b %d')
+
+def drawLineChart(title, timestamps, prices, reference_price, window):
+    '''
+    Draws a Google-style trend chart: current price and change up top, the price line (green if we're up, red if down),
+    a dotted reference line, price gridlines on the right and time labels along the bottom
+    Returns a PIL Image
+    '''
+
+    im = Image.new('RGB', (CHART_WIDTH, CHART_HEIGHT), BACKGROUND_COLOR)
+    draw = ImageDraw.Draw(im)
+    font = ImageFont.load_default()
+
+    last_price = prices[-1]
+    change = last_price - reference_price
+    change_pct = change / reference_price * 100 if reference_price else 0
+    line_color = UP_COLOR if change >= 0 else DOWN_COLOR
+
+    # Header: ticker, price and change
+    draw.text((MARGIN_LEFT, 8), title, fill=MUTED_COLOR, font=font)
+    draw.text((MARGIN_LEFT, 24), f"${last_price:,.2f}", fill=TEXT_COLOR, font=font)
+    draw.text((MARGIN_LEFT + 90, 24), f"{'+' if change >= 0 else ''}{change:,.2f} ({change_pct:+.2f}%) {window}", fill=line_color, font=font)
+
+    # Scale prices & times to the plot area
+    plot_left, plot_right = MARGIN_LEFT, CHART_WIDTH - MARGIN_RIGHT
+    plot_top, plot_bottom = MARGIN_TOP, CHART_HEIGHT - MARGIN_BOTTOM
+    low = min(min(prices), reference_price)
+    high = max(max(prices), reference_price)
+    padding = (high - low) * 0.05 or 1
+    low, high = low - padding, high + padding
+    start, end = timestamps[0], timestamps[-1]
+    span = (end - start).total_seconds() or 1
+
+    def toX(timestamp):
+        return plot_left + (timestamp - start).total_seconds() / span * (plot_right - plot_left)
+
+    def toY(price):
+        return plot_bottom - (price - low) / (high - low) * (plot_bottom - plot_top)
+
+    # Price gridlines with labels on the right
+    for i in range(5):
+        price = low + (high - low) * i / 4
+        y = toY(price)
+        draw.line([(plot_left, y), (plot_right, y)], fill=GRID_COLOR)
+        draw.text((plot_right + 6, y - 6), f"{price:,.2f}", fill=MUTED_COLOR, font=font)
+
+    # Time labels along the bottom
+    for i in range(4):
+        timestamp = start + (end - start) * i / 3
+        x = toX(timestamp)
+        draw.text((min(x, plot_right - 40), plot_bottom + 8), formatTimeLabel(timestamp, window), fill=MUTED_COLOR, font=font)
+
+    # Dotted reference line (prior close / start of the window)
+    y = toY(reference_price)
+    for x in range(plot_left, plot_right, 8):
+        draw.line([(x, y), (x + 3, y)], fill=MUTED_COLOR)
+
+    # And finally, the line itself
+    draw.line([(toX(x), toY(p)) for x, p in zip(timestamps, prices)], fill=line_color, width=2)
+
+    return im
+
+def renderTrendChart(ticker, window='1d', end=None):
+    '''
+    Draws the trend chart for {ticker} over the window ('1d', '5d', '1m', '6m' or '1y') ending now (or at {end})
+    Returns a PIL Image. Raises NotEnoughDataError if we don't have the data to draw it
+    '''
+
+    timestamps, prices, reference_price = getChartData(ticker, window, end)
+
+    return drawLineChart(ticker, timestamps, prices, reference_price, window)
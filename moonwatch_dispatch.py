@@ -0,0 +1,254 @@
+'''
+One outbound queue for everything we post (Slack messages, tweets, retweets, follows)
+Each endpoint gets a token bucket, kept in line with what the other side tells us (x-rate-limit-remaining, x-rate-limit-reset,
+Retry-After), so bursts get spread out instead of bouncing off rate limits. Sends go out in priority order (the EOD summary
+doesn't wait behind a pile of retweets), and a send that gets rate limited anyway is put back in the queue for later instead of dropped
+'''
+
+import heapq
+import itertools
+import threading
+import time as t
+from concurrent.futures import Future
+from dataclasses import dataclass, field
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+# capacity = how big a burst can go out at once, per_second = how fast the bucket refills
+ENDPOINT_LIMITS = {
+    # Slack allows about one message per second per channel, with short bursts
+    'slack': {'capacity': 3, 'per_second': 1},
+    # Tweets and retweets share 300 per 3 hours
+    'twitter:tweet': {'capacity': 5, 'per_second': 300/10800},
+    'twitter:follow': {'capacity': 5, 'per_second': 400/86400},
+}
+DEFAULT_LIMIT = {'capacity': 5, 'per_second': 1}
+
+# Lower goes first
+PRIORITIES = {
+    'eod': 0,
+    'price': 1,
+    'trend': 2,
+    'default': 3,
+    'greeting': 4,
+    'retweet': 5,
+    'follow': 6,
+}
+
+# A rate limited send is retried this many times, waiting as long as we're told to (or DEFAULT_RETRY_SECONDS, doubling each time)
+MAX_ATTEMPTS = 5
+DEFAULT_RETRY_SECONDS = 60
+
+
+"""
+------------------------------------
+TOKEN BUCKETS
+------------------------------------
+"""
+class TokenBucket:
+    '''
+    {capacity} tokens, refilled at {per_second} tokens per second. Every send takes one
+    '''
+
+    def __init__(self, capacity, per_second):
+        self.capacity = capacity
+        self.per_second = per_second
+        self.tokens = capacity
+        self.updated = t.monotonic()
+        self.paused_until = 0
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.per_second)
+        self.updated = now
+
+    def getWaitSeconds(self, now):
+        '''
+        Returns how long until a token is available (0 = right now)
+        '''
+
+        self.refill(now)
+        if now < self.paused_until:
+            return self.paused_until - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.per_second
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+    def pause(self, seconds, now):
+        self.paused_until = max(self.paused_until, now + seconds)
+
+    def updateFromHeaders(self, headers, now):
+        '''
+        Lines the bucket up with the rate limit headers on a response
+        '''
+
+        if not headers:
+            return
+
+        remaining = headers.get('x-rate-limit-remaining')
+        if remaining is not None and str(remaining).isdigit():
+            self.tokens = min(self.tokens, int(remaining))
+            reset = headers.get('x-rate-limit-reset')
+            if int(remaining) == 0 and reset is not None and str(reset).isdigit():
+                self.pause(int(reset) - t.time(), now)
+
+        retry_after = headers.get('Retry-After')
+        if retry_after is not None and str(retry_after).isdigit():
+            self.pause(int(retry_after), now)
+
+def getRetryAfterSeconds(e, attempts):
+    '''
+    Returns how long to wait before retrying if this exception means we were rate limited, or None if it's some other failure
+    Works for requests' HTTPError and tweepy's TweepError, which both carry the response
+    '''
+
+    response = getattr(e, 'response', None)
+    rate_limited = getattr(response, 'status_code', None) == 429 or getattr(e, 'api_code', None) == 88
+    if not rate_limited:
+        return None
+
+    headers = getattr(response, 'headers', None) or dict()
+    if str(headers.get('Retry-After', '')).isdigit():
+        return int(headers['Retry-After'])
+    if str(headers.get('x-rate-limit-reset', '')).isdigit():
+        return max(int(headers['x-rate-limit-reset']) - t.time(), 1)
+
+    return DEFAULT_RETRY_SECONDS * 2**(attempts-1)
+
+
+"""
+------------------------------------
+DISPATCHER
+------------------------------------
+"""
+@dataclass
+class Send:
+    endpoint: str
+    func: object
+    args: tuple
+    kwargs: dict
+    headers_of: object = None
+    description: str = None
+    future: Future = field(default_factory=Future)
+    attempts: int = 0
+    not_before: float = 0
+
+class Dispatcher:
+    '''
+    Runs queued sends best priority first, as fast as each endpoint's bucket allows
+    Every endpoint has its own queue and its own worker thread, so a slow or retrying send only holds up its own endpoint
+    (a Slack hiccup doesn't keep the tweets waiting, and a slow media upload doesn't keep the EOD Slack message waiting)
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._conditions = dict() # endpoint -> Condition (all on _lock)
+        self._queues = dict() # endpoint -> [(priority, sequence, Send)]
+        self._sequence = itertools.count()
+        self._buckets = dict()
+        self._workers = dict() # endpoint -> Thread
+
+    def getBucket(self, endpoint):
+        '''
+        Call with the lock held
+        '''
+
+        if endpoint not in self._buckets:
+            limits = ENDPOINT_LIMITS.get(endpoint) or ENDPOINT_LIMITS.get(endpoint.split(':')[0], DEFAULT_LIMIT)
+            self._buckets[endpoint] = TokenBucket(limits['capacity'], limits['per_second'])
+
+        return self._buckets[endpoint]
+
+    def send(self, endpoint, func, *args, priority='default', headers_of=None, description=None, **kwargs):
+        '''
+        Queues func(*args, **kwargs) to run against this endpoint's rate limit and returns a Future with its result
+        headers_of(result) (optional) returns the response headers to update the bucket with - by default, result.headers if there is one
+        '''
+
+        item = Send(endpoint=endpoint, func=func, args=args, kwargs=kwargs, headers_of=headers_of,
+                    description=description or getattr(func, '__name__', 'send'))
+
+        with self._lock:
+            if endpoint not in self._workers:
+                self._conditions[endpoint] = threading.Condition(self._lock)
+                self._queues[endpoint] = []
+                self._workers[endpoint] = threading.Thread(target=self.run, args=(endpoint,), name=f'moonwatch_dispatch:{endpoint}', daemon=True)
+                self._workers[endpoint].start()
+            heapq.heappush(self._queues[endpoint], (PRIORITIES.get(priority, PRIORITIES['default']), next(self._sequence), item))
+            self._conditions[endpoint].notify()
+
+        return item.future
+
+    def getNextSend(self, endpoint):
+        '''
+        Blocks until the best queued send for this endpoint is allowed to go, takes it off the queue and takes its token
+        '''
+
+        with self._lock:
+            queue = self._queues[endpoint]
+            while True:
+                now = t.monotonic()
+                bucket_wait = self.getBucket(endpoint).getWaitSeconds(now)
+                wait_seconds = None
+                for entry in sorted(queue):
+                    wait = max(entry[2].not_before - now, bucket_wait)
+                    if wait <= 0:
+                        queue.remove(entry)
+                        heapq.heapify(queue)
+                        self.getBucket(endpoint).take(now)
+                        return entry
+                    wait_seconds = wait if wait_seconds is None else min(wait_seconds, wait)
+
+                self._conditions[endpoint].wait(wait_seconds)
+
+    def run(self, endpoint):
+
+        while True:
+            priority, sequence, item = self.getNextSend(endpoint)
+            item.attempts += 1
+
+            try:
+                result = item.func(*item.args, **item.kwargs)
+            except Exception as e:
+                retry_after = getRetryAfterSeconds(e, item.attempts)
+                with self._lock:
+                    now = t.monotonic()
+                    if retry_after is not None:
+                        self.getBucket(endpoint).pause(retry_after, now)
+                    if retry_after is not None and item.attempts < MAX_ATTEMPTS:
+                        print(f"{item.description} was rate limited by {endpoint} - trying again in {round(retry_after)}s")
+                        item.not_before = now + retry_after
+                        heapq.heappush(self._queues[endpoint], (priority, sequence, item))
+                        continue
+                print(f"{item.description} failed: {e}")
+                item.future.set_exception(e)
+                continue
+
+            try:
+                headers = item.headers_of(result) if item.headers_of else getattr(result, 'headers', None)
+                with self._lock:
+                    self.getBucket(endpoint).updateFromHeaders(headers, t.monotonic())
+            except Exception as e:
+                print(f"Couldn't read rate limit headers for {item.description}: {e}")
+
+            item.future.set_result(result)
+
+    def getQueueLength(self):
+
+        with self._lock:
+            return sum(len(x) for x in self._queues.values())
+
+dispatcher = Dispatcher()
+
+def send(endpoint, func, *args, **kwargs):
+    '''
+    Shortcut for dispatcher.send
+    '''
+
+    return dispatcher.send(endpoint, func, *args, **kwargs)
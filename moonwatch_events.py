@@ -0,0 +1,80 @@
+'''
+A tiny in-process publish/subscribe bus for price events
+The price checks publish, and every channel (Slack, Twitter, ...) subscribes to the events it cares about,
+so notifications go out as soon as a price is fetched instead of each channel polling for it
+'''
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from datetime import datetime
+
+"""
+------------------------------------
+EVENTS
+------------------------------------
+"""
+@dataclass(frozen=True)
+class PriceTick:
+    '''
+    Published for every price we fetch, changed or not
+    '''
+    ticker: str
+    price: float
+    timestamp: datetime
+    change_percent: float = None # since the prior close, in percent
+
+@dataclass(frozen=True)
+class PriceChanged:
+    '''
+    Published when a ticker's price is different from the last one on record
+    '''
+    ticker: str
+    price: float
+    previous_price: float
+    price_change: float # since the last price on record, as a fraction (0.01 = 1%)
+    timestamp: datetime
+
+
+"""
+------------------------------------
+BUS
+------------------------------------
+"""
+# Handlers run on their own small pool, so a slow Slack post doesn't hold up the tweet (or the price check that published)
+_dispatch_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix='moonwatch_events')
+_subscribers_lock = threading.Lock()
+_subscribers = []
+
+def subscribe(event_type, handler, event_filter=None):
+    '''
+    Calls handler(event) for every published event of this type (and only if event_filter(event) is True, when given)
+    '''
+
+    with _subscribers_lock:
+        _subscribers.append((event_type, handler, event_filter))
+
+def unsubscribe(event_type, handler):
+
+    with _subscribers_lock:
+        _subscribers[:] = [x for x in _subscribers if not (x[0] is event_type and x[1] is handler)]
+
+def runHandler(handler, event_filter, event):
+
+    try:
+        if event_filter is None or event_filter(event):
+            handler(event)
+    except Exception as e:
+        print(f"{handler.__name__} failed on {event}: {e}")
+
+def publish(event):
+    '''
+    Hands the event to every matching subscriber and returns right away
+    '''
+
+    with _subscribers_lock:
+        subscribers = list(_subscribers)
+
+    for event_type, handler, event_filter in subscribers:
+        if isinstance(event, event_type):
+            _dispatch_pool.submit(runHandler, handler, event_filter, event)
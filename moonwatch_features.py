@@ -0,0 +1,123 @@
+'''
+Calculated fields for daily price history (the HISTORICAL_DATA tab)
+Everything here works on whole columns at once and handles any number of tickers in one pass
+'''
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+import pandas as pd
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+PRICE_COLUMNS = ['open','high','low','close','volume','adjclose']
+
+# Volume rank & percentile compare each day against the trading days in this window (ending on that day)
+VOLUME_RANK_WINDOW = '365D'
+
+HISTORICAL_COLUMNS = (['Date','Ticker']
+                      + PRICE_COLUMNS
+                      + ['volume_rank','volume_percentile']
+                      + [x+' prior day' for x in PRICE_COLUMNS]
+                      + ['Intraday Price Change (Dollars)'
+                        ,'Intraday Price Change (Percentage)'
+                        ,'Closing Price Delta from Prior Day (Dollars)'
+                        ,'Closing Price Delta from Prior Day (Percentage)'])
+
+
+"""
+------------------------------------
+FEATURES
+------------------------------------
+"""
+def convertEpochsToDates(epochs):
+    '''
+    Turns a column of epoch timestamps (seconds) into "YYYY-MM-DD" strings (UTC)
+    '''
+
+    return pd.to_datetime(epochs, unit='s').dt.strftime('%Y-%m-%d')
+
+def addPriorDayColumns(prices_df):
+    '''
+    Adds "{column} prior day" for every price column: the previous trading day's value for the same ticker.
+    prices_df must be sorted by Ticker, then Date
+    '''
+
+    prior_day = prices_df.groupby('Ticker')[PRICE_COLUMNS].shift(1)
+    prior_day.columns = [x+' prior day' for x in PRICE_COLUMNS]
+
+    return pd.concat([prices_df, prior_day], axis=1)
+
+def addVolumeRankColumns(prices_df):
+    '''
+    Adds volume_rank (1 = the most traded day of the past 52 weeks) and volume_percentile
+    (share of the past 52 weeks' trading days with this much volume or less) for each ticker.
+    prices_df must be sorted by Ticker, then Date
+    Each day's window starts with searchsorted on the sorted dates (no Rolling.rank, which pandas 1.3 doesn't have),
+    and every day is compared with its whole window at once with a sliding window view - no Python loop over the days
+    '''
+
+    volume_rank = np.empty(len(prices_df), dtype=int)
+    volume_percentile = np.empty(len(prices_df))
+
+    dates = pd.to_datetime(prices_df['Date']).to_numpy()
+    volumes = prices_df['volume'].to_numpy(dtype=float)
+    window = pd.Timedelta(VOLUME_RANK_WINDOW).to_timedelta64()
+
+    for positions in prices_df.groupby('Ticker', sort=False).indices.values():
+        ticker_dates = dates[positions]
+        ticker_volumes = volumes[positions]
+        # Same window as rolling('365D'): the days after (this day - 365 days), up to and including this day
+        days = np.arange(len(positions))
+        window_starts = np.searchsorted(ticker_dates, ticker_dates - window, side='right')
+        window_lengths = days - window_starts + 1
+
+        # Row i of the view is the {widest window} days up to and including day i (padded on the left so every row is full),
+        # with the days before day i's own window start masked out
+        widest_window = window_lengths.max()
+        padded_volumes = np.concatenate([np.full(widest_window - 1, np.nan), ticker_volumes])
+        window_volumes = sliding_window_view(padded_volumes, widest_window)
+        in_window = np.arange(widest_window) >= (widest_window - window_lengths)[:, None]
+
+        volume_rank[positions] = ((window_volumes > ticker_volumes[:, None]) & in_window).sum(axis=1) + 1
+        volume_percentile[positions] = ((window_volumes <= ticker_volumes[:, None]) & in_window).sum(axis=1) / window_lengths
+
+    prices_df = prices_df.copy()
+    prices_df['volume_rank'] = volume_rank
+    prices_df['volume_percentile'] = volume_percentile
+
+    return prices_df
+
+def addPriceChangeColumns(prices_df):
+    '''
+    Adds intraday (open to close) and day-over-day (prior close to close) price changes, in dollars and percent
+    '''
+
+    prices_df = prices_df.copy()
+    prices_df['Intraday Price Change (Dollars)'] = prices_df['close'] - prices_df['open']
+    prices_df['Intraday Price Change (Percentage)'] = prices_df['close'] / prices_df['open'] - 1
+    prices_df['Closing Price Delta from Prior Day (Dollars)'] = prices_df['close'] - prices_df['close prior day']
+    prices_df['Closing Price Delta from Prior Day (Percentage)'] = prices_df['close'] / prices_df['close prior day'] - 1
+
+    return prices_df
+
+def calculateHistoricalFeatures(prices_df):
+    '''
+    Given daily prices (Date, Ticker, open, high, low, close, volume, adjclose) for one or more tickers, in any order,
+    returns the HISTORICAL_DATA columns: prices, volume rank & percentile, the prior day's prices and the price changes.
+    The oldest day of each ticker is dropped from the output, since it has no prior day to compare to
+    '''
+
+    prices_df = (prices_df.dropna(subset=['close'])
+                          .drop_duplicates(subset=['Ticker','Date'], keep='last')
+                          .sort_values(['Ticker','Date'])
+                          .reset_index(drop=True))
+
+    features_df = addVolumeRankColumns(prices_df)
+    features_df = addPriorDayColumns(features_df)
+    features_df = addPriceChangeColumns(features_df)
+    features_df = features_df.dropna(subset=['close prior day'])
+
+    return features_df[HISTORICAL_COLUMNS].reset_index(drop=True)
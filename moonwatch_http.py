@@ -0,0 +1,161 @@
+'''
+Shared HTTP plumbing for every outbound call Moonwatch makes (Slack, Yahoo! Finance via RapidAPI, Imgur)
+One keep-alive connection pool per host, timeouts on everything, and retries with jittered backoff when the other side is having a bad day
+'''
+
+import random
+import threading
+import time as t
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import ConnectTimeoutError, NewConnectionError
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+# (connect timeout, read timeout) in seconds, how many times to retry, which status codes are worth retrying,
+# and whether the request can be safely repeated once the server may have seen it (see failedBeforeSending)
+ENDPOINTS = {
+    # Posting a message isn't idempotent: after a read timeout or a 5xx it may well have gone out already, so only
+    # connection failures are retried. Slack's 429s are left to the dispatcher (moonwatch_dispatch), which waits them out
+    'slack': {'timeout': (3.05, 10), 'retries': 3, 'retry_statuses': set(), 'idempotent': False},
+    # Every retry costs us one of our 500 monthly calls, so only retry when RapidAPI/Yahoo are actually down
+    'rapidapi': {'timeout': (3.05, 20), 'retries': 1, 'retry_statuses': {500, 502, 503, 504}, 'idempotent': True},
+    # Same for uploads (a 429 means Imgur turned the upload down, so that one is safe to retry)
+    'imgur': {'timeout': (3.05, 30), 'retries': 2, 'retry_statuses': {429}, 'idempotent': False},
+}
+DEFAULT_ENDPOINT = {'timeout': (3.05, 15), 'retries': 2, 'retry_statuses': {429, 500, 502, 503, 504}, 'idempotent': True}
+
+BACKOFF_BASE_SECONDS = 1
+BACKOFF_MAX_SECONDS = 30
+POOL_MAXSIZE = 10 # one connection per scheduler worker
+
+_sessions_lock = threading.Lock()
+_sessions = dict()
+_latency_stats = dict()
+
+
+"""
+------------------------------------
+SESSIONS
+------------------------------------
+"""
+def getSession(url):
+    '''
+    Returns the shared session for this URL's host, so repeat calls reuse the same TLS connection instead of doing a new handshake
+    '''
+
+    host = urlparse(url).netloc
+
+    with _sessions_lock:
+        if host not in _sessions:
+            session = requests.Session()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=POOL_MAXSIZE, max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _sessions[host] = session
+
+        return _sessions[host]
+
+def getBackoffSeconds(attempt, response=None):
+    '''
+    Exponential backoff with jitter. If the server told us how long to wait (Retry-After), we do what it says
+    '''
+
+    if response is not None and response.headers.get('Retry-After', '').isdigit():
+        return min(int(response.headers['Retry-After']), BACKOFF_MAX_SECONDS)
+
+    backoff = BACKOFF_BASE_SECONDS * 2**attempt
+    return min(backoff * random.uniform(0.5, 1.5), BACKOFF_MAX_SECONDS)
+
+def failedBeforeSending(e):
+    '''
+    True if the request never made it to the server: the connection timed out or couldn't be made at all.
+    Anything else (read timeout, connection dropped mid-request) may have happened after the server got the request
+    '''
+
+    if isinstance(e, requests.exceptions.ConnectTimeout):
+        return True
+    if isinstance(e, requests.exceptions.ConnectionError) and not isinstance(e, requests.exceptions.ReadTimeout):
+        reason = getattr(e.args[0], 'reason', None) if e.args else None
+        return isinstance(reason, (NewConnectionError, ConnectTimeoutError))
+
+    return False
+
+
+"""
+------------------------------------
+REQUESTS
+------------------------------------
+"""
+def request(method, url, endpoint=None, on_attempt=None, **kwargs):
+    '''
+    Makes an HTTP request through the shared session for this host, with the timeout & retry settings for this endpoint.
+    on_attempt (optional) is called once per attempt, e.g. to count paid API calls
+    Requests to non-idempotent endpoints are only retried if they failed before reaching the server
+    Returns the requests Response object
+    '''
+
+    settings = ENDPOINTS.get(endpoint, DEFAULT_ENDPOINT)
+    kwargs.setdefault('timeout', settings['timeout'])
+    session = getSession(url)
+    name = endpoint or urlparse(url).netloc
+
+    for attempt in range(settings['retries']+1):
+        start = t.perf_counter()
+        try:
+            response = session.request(method, url, **kwargs)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if on_attempt:
+                on_attempt()
+            print(f"{method} {name} failed after {round((t.perf_counter()-start)*1000)}ms: {e.__class__.__name__}")
+            if attempt == settings['retries'] or not (settings['idempotent'] or failedBeforeSending(e)):
+                raise
+            t.sleep(getBackoffSeconds(attempt))
+            continue
+
+        if on_attempt:
+            on_attempt()
+        recordLatency(name, t.perf_counter()-start)
+        print(f"{method} {name} -> {response.status_code} in {round((t.perf_counter()-start)*1000)}ms")
+
+        if response.status_code in settings['retry_statuses'] and attempt < settings['retries']:
+            t.sleep(getBackoffSeconds(attempt, response))
+            continue
+
+        return response
+
+def get(url, endpoint=None, **kwargs):
+    return request("GET", url, endpoint=endpoint, **kwargs)
+
+def post(url, endpoint=None, **kwargs):
+    return request("POST", url, endpoint=endpoint, **kwargs)
+
+
+"""
+------------------------------------
+LATENCY STATS
+------------------------------------
+"""
+def recordLatency(name, seconds):
+
+    with _sessions_lock:
+        stats = _latency_stats.setdefault(name, {'calls': 0, 'total_ms': 0, 'max_ms': 0})
+        stats['calls'] += 1
+        stats['total_ms'] += seconds*1000
+        stats['max_ms'] = max(stats['max_ms'], seconds*1000)
+
+def getLatencyStats():
+    '''
+    Returns {endpoint: {'calls', 'avg_ms', 'max_ms'}} for every endpoint called since the process started
+    '''
+
+    with _sessions_lock:
+        return {name: {'calls': stats['calls'],
+                       'avg_ms': round(stats['total_ms']/stats['calls']),
+                       'max_ms': round(stats['max_ms'])}
+                for name, stats in _latency_stats.items()}
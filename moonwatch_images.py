@@ -0,0 +1,131 @@
+'''
+Trend images, rendered once per ticker, window and time slot and shared by every channel (Slack, Twitter, ...)
+Images are content-addressed (by the sha256 of their bytes), so each channel's upload (Imgur URL, Twitter media ID)
+is only done once per image too - even across slots, if the chart hasn't changed in between
+'''
+
+import hashlib
+import os
+import threading
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+
+import moonwatch_budget as budget
+import moonwatch_charts as charts
+import moonwatch_utils as moon
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+# Intraday charts are rendered at most once per slot of this many minutes
+RENDER_SLOT_MINUTES = int(os.getenv("TREND_IMAGE_SLOT_MINUTES", 30))
+
+# Twitter media IDs can only be attached to a tweet for 24 hours after upload - re-upload well before that
+UPLOAD_TTL = {
+    'twitter': timedelta(hours=12)
+}
+
+_images_lock = threading.Lock()
+_slot_locks = dict()
+_slots = dict() # (ticker, window, slot) -> digest
+_images = dict() # digest -> TrendImage
+
+
+"""
+------------------------------------
+CACHE
+------------------------------------
+"""
+@dataclass
+class TrendImage:
+    ticker: str
+    window: str
+    digest: str
+    data: bytes # PNG
+    uploads: dict = field(default_factory=dict) # destination -> (url or media ID, uploaded at)
+    lock: threading.Lock = field(default_factory=threading.Lock, repr=False)
+
+    @property
+    def name(self):
+        '''
+        A filename for the uploads - unique per image, nothing is actually written to disk
+        '''
+        return f'{self.ticker}_{self.window}_{self.digest[:12]}.png'
+
+def getRenderSlot(window, now=None):
+    '''
+    Returns the time slot an image for this window belongs to
+    Charts from daily data only change once a day; intraday charts change every few minutes while the market is open
+    but not at all after it closes, so everything after the close shares the closing slot
+    '''
+
+    now = now or datetime.now()
+    if charts.WINDOWS.get(window, ('ticks',))[0] == 'daily':
+        return now.date()
+
+    market_close = datetime(now.year, now.month, now.day, *budget.MARKET_CLOSE)
+    now = min(now, market_close)
+    minutes = (now.hour * 60 + now.minute) // RENDER_SLOT_MINUTES * RENDER_SLOT_MINUTES
+    return datetime(now.year, now.month, now.day, minutes // 60, minutes % 60)
+
+def pruneImages(today):
+    '''
+    Forgets slots from before today, and any image no slot points to anymore. Call with _images_lock held
+    '''
+
+    for key in [x for x in _slots if (x[2].date() if isinstance(x[2], datetime) else x[2]) < today]:
+        del _slots[key]
+        _slot_locks.pop(key, None)
+
+    used = set(_slots.values())
+    for digest in [x for x in _images if x not in used]:
+        del _images[digest]
+
+def getTrendImage(ticker, window='1d'):
+    '''
+    Returns the TrendImage for {ticker} in the current slot, rendering it only if nobody has yet
+    Jobs asking for the same slot at the same time wait for the first one's render instead of doing their own
+    '''
+
+    key = (ticker, window, getRenderSlot(window))
+
+    with _images_lock:
+        pruneImages(date.today())
+        slot_lock = _slot_locks.setdefault(key, threading.Lock())
+
+    with slot_lock:
+        with _images_lock:
+            if key in _slots:
+                print(f"Reusing the {window} trend image for {ticker} from this slot")
+                return _images[_slots[key]]
+
+        data = moon.getTrendImage(ticker, window)
+        digest = hashlib.sha256(data).hexdigest()
+
+        with _images_lock:
+            if digest not in _images:
+                _images[digest] = TrendImage(ticker=ticker, window=window, digest=digest, data=data)
+            _slots[key] = digest
+
+            return _images[digest]
+
+def getUpload(image, destination, upload):
+    '''
+    Returns this image's URL/media ID on {destination}, calling upload(image) only if it hasn't been uploaded there yet
+    (or the last upload has expired). Failed uploads (upload returned None) aren't remembered, so the next job tries again
+    '''
+
+    with image.lock:
+        if destination in image.uploads:
+            uploaded, uploaded_at = image.uploads[destination]
+            if destination not in UPLOAD_TTL or datetime.now() - uploaded_at < UPLOAD_TTL[destination]:
+                print(f"{image.ticker} trend image is already on {destination}: {uploaded}")
+                return uploaded
+
+        uploaded = upload(image)
+        if uploaded is not None:
+            image.uploads[destination] = (uploaded, datetime.now())
+
+        return uploaded
@@ -0,0 +1,440 @@
+'''
+Local storage for Moonwatch
+A small SQLite database living next to the app. This is the system of record for price ticks and daily OHLC data -
+the Google Sheets tabs are a mirror of it for humans to look at (see moonwatch_utils.mirrorStoreToGoogleSheets)
+'''
+
+import json
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+DB_PATH = os.getenv("MOONWATCH_DB_PATH", "moonwatch.db")
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS latest_prices (
+    ticker TEXT PRIMARY KEY,
+    timestamp TEXT NOT NULL,
+    price REAL NOT NULL,
+    source TEXT,
+    checked_at TEXT
+);
+
+CREATE TABLE IF NOT EXISTS ticks (
+    ticker TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    date TEXT NOT NULL,
+    price REAL NOT NULL,
+    mirrored INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ticker, timestamp)
+);
+CREATE INDEX IF NOT EXISTS ticks_by_mirrored ON ticks (mirrored);
+
+CREATE TABLE IF NOT EXISTS daily_bars (
+    ticker TEXT NOT NULL,
+    date TEXT NOT NULL,
+    open REAL,
+    high REAL,
+    low REAL,
+    close REAL,
+    volume REAL,
+    adjclose REAL,
+    extra TEXT,
+    mirrored INTEGER NOT NULL DEFAULT 0,
+    version INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (ticker, date)
+);
+CREATE INDEX IF NOT EXISTS daily_bars_by_mirrored ON daily_bars (mirrored);
+
+CREATE TABLE IF NOT EXISTS api_calls (
+    api_key_id TEXT NOT NULL,
+    endpoint TEXT NOT NULL,
+    called_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS api_calls_by_key_and_time ON api_calls (api_key_id, called_at);
+
+CREATE TABLE IF NOT EXISTS twitter_actions (
+    action TEXT NOT NULL,
+    id INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL,
+    PRIMARY KEY (action, id)
+);
+CREATE INDEX IF NOT EXISTS twitter_actions_by_time ON twitter_actions (recorded_at);
+
+CREATE TABLE IF NOT EXISTS key_values (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+# Columns added after their table was first created: (table, column, type). Databases made before then get them added on connect
+ADDED_COLUMNS = [
+    ('latest_prices', 'source', 'TEXT'),
+    ('latest_prices', 'checked_at', 'TEXT'),
+    ('daily_bars', 'version', 'INTEGER NOT NULL DEFAULT 0'),
+]
+
+# Daily bar columns that get their own column in the database. Everything else (derived fields) is kept as JSON in "extra"
+DAILY_BAR_COLUMNS = ['open','high','low','close','volume','adjclose']
+
+# sqlite handles locking between processes, this lock keeps the scheduler threads in one process from tripping over each other
+_db_lock = threading.Lock()
+_schema_ready = False
+
+
+"""
+------------------------------------
+CONNECTIONS
+------------------------------------
+"""
+@contextmanager
+def connectToStore():
+    '''
+    Opens a connection to the local database (creating the tables the first time) and commits when the block exits
+    '''
+
+    global _schema_ready
+
+    with _db_lock:
+        conn = sqlite3.connect(DB_PATH, timeout=30)
+        try:
+            if not _schema_ready:
+                conn.executescript(SCHEMA)
+                addMissingColumns(conn)
+                _schema_ready = True
+            yield conn
+            conn.commit()
+        finally:
+            conn.close()
+
+def addMissingColumns(conn):
+    '''
+    Adds the ADDED_COLUMNS a database made by an older version doesn't have yet (CREATE TABLE IF NOT EXISTS leaves existing tables alone)
+    '''
+
+    for table, column, column_type in ADDED_COLUMNS:
+        existing_columns = [x[1] for x in conn.execute(f"PRAGMA table_info({table})")]
+        if column not in existing_columns:
+            conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {column_type}")
+
+def convertToPlainPython(value):
+    '''
+    Turns numpy/pandas scalars into plain Python values that sqlite and json know how to store (NaN becomes None)
+    '''
+
+    if hasattr(value, 'item'):
+        value = value.item()
+    if isinstance(value, float) and value != value:
+        return None
+    return value
+
+
+"""
+------------------------------------
+LATEST PRICE INDEX
+------------------------------------
+"""
+def getLatestPrices(tickers):
+    '''
+    Returns {ticker: (timestamp, price, source, checked_at)} of the most recent tick we have recorded for each of these tickers,
+    in one query. Tickers we haven't seen yet (e.g. fresh dyno with an empty database) are left out
+    source is 'poll' if this database got it from the API itself, 'sheet' if it was copied from the Google Sheet
+    (None for entries from before we kept track); checked_at is when it was last written here
+    '''
+
+    with connectToStore() as conn:
+        rows = conn.execute(f"""
+            SELECT ticker, timestamp, price, source, checked_at FROM latest_prices
+            WHERE ticker IN ({", ".join("?" for x in tickers)})
+        """, list(tickers)).fetchall()
+
+    return {row[0]: row[1:] for row in rows}
+
+def normalizeTimestamp(timestamp):
+    '''
+    Returns the timestamp as "YYYY-MM-DD HH:MM:SS[.ffffff]", whatever it came in as (a datetime from a poll, or however the
+    Google Sheet displays it, e.g. "7/22/2021 14:30"), so timestamps from anywhere compare correctly as strings
+    '''
+
+    return pd.Timestamp(timestamp).isoformat(sep=' ')
+
+def setLatestPrice(ticker, timestamp, price, source='poll'):
+    '''
+    Records a tick in the index. Older ticks never overwrite newer ones, so the order in which jobs finish doesn't matter
+    '''
+
+    with connectToStore() as conn:
+        conn.execute('''
+            INSERT INTO latest_prices (ticker, timestamp, price, source, checked_at) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(ticker) DO UPDATE SET timestamp = excluded.timestamp, price = excluded.price,
+                source = excluded.source, checked_at = excluded.checked_at
+            WHERE excluded.timestamp >= latest_prices.timestamp
+                -- entries saved before timestamps were normalized can't be compared, so they're always replaced
+                OR latest_prices.timestamp NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9] *'
+        ''', (ticker, normalizeTimestamp(timestamp), float(price), source, datetime.now().isoformat()))
+
+
+"""
+------------------------------------
+PRICE TICKS
+------------------------------------
+"""
+def insertTicks(ticks_df):
+    '''
+    Saves new price ticks (a dataframe with Date, Timestamp, Ticker and Price columns) and updates the latest price index.
+    The ticks are flagged as not yet mirrored to Google Sheets
+    '''
+
+    rows = [(row['Ticker'], str(row['Timestamp']), str(row['Date']), float(row['Price']))
+            for row in ticks_df.to_dict('records')]
+
+    with connectToStore() as conn:
+        conn.executemany("INSERT OR IGNORE INTO ticks (ticker, timestamp, date, price) VALUES (?, ?, ?, ?)", rows)
+
+    for ticker, timestamp, tick_date, price in rows:
+        setLatestPrice(ticker, timestamp, price)
+
+def getTicks(ticker, start=None, end=None):
+    '''
+    Returns a dataframe of the ticks for this ticker (Date, Timestamp, Ticker, Price), oldest first,
+    optionally only between the start and end timestamps
+    '''
+
+    query = "SELECT date AS Date, timestamp AS Timestamp, ticker AS Ticker, price AS Price FROM ticks WHERE ticker = ?"
+    params = [ticker]
+    if start is not None:
+        query += " AND timestamp >= ?"
+        params.append(str(start))
+    if end is not None:
+        query += " AND timestamp <= ?"
+        params.append(str(end))
+    query += " ORDER BY timestamp"
+
+    with connectToStore() as conn:
+        return pd.read_sql_query(query, conn, params=params)
+
+def getUnmirroredTicks(limit=1000):
+
+    with connectToStore() as conn:
+        return pd.read_sql_query("""
+            SELECT date AS Date, timestamp AS Timestamp, ticker AS Ticker, price AS Price FROM ticks
+            WHERE mirrored = 0 ORDER BY timestamp LIMIT ?
+        """, conn, params=[limit])
+
+def markTicksMirrored(ticks_df):
+    '''
+    Ticks never change once they're saved (see insertTicks), so the ones we read are exactly the ones that were mirrored
+    '''
+
+    with connectToStore() as conn:
+        conn.executemany("UPDATE ticks SET mirrored = 1 WHERE ticker = ? AND timestamp = ?",
+                         list(zip(ticks_df['Ticker'], ticks_df['Timestamp'])))
+
+
+"""
+------------------------------------
+DAILY BARS
+------------------------------------
+"""
+def upsertDailyBars(daily_df):
+    '''
+    Saves daily OHLC rows (same columns as the HISTORICAL_DATA tab, keyed by Date & Ticker), replacing any existing row for that day.
+    The rows are flagged as not yet mirrored to Google Sheets, and every replacement bumps the row's version (see markDailyBarsMirrored)
+    '''
+
+    rows = []
+    for row in daily_df.to_dict('records'):
+        row = {k: convertToPlainPython(v) for k, v in row.items()}
+        extra = {k: v for k, v in row.items() if k not in DAILY_BAR_COLUMNS and k not in ('Date','Ticker')}
+        rows.append([row['Ticker'], str(row['Date'])] + [row.get(x) for x in DAILY_BAR_COLUMNS] + [json.dumps(extra, default=str)])
+
+    with connectToStore() as conn:
+        conn.executemany(f"""
+            INSERT INTO daily_bars (ticker, date, {", ".join(DAILY_BAR_COLUMNS)}, extra, mirrored)
+            VALUES (?, ?, {", ".join("?" for x in DAILY_BAR_COLUMNS)}, ?, 0)
+            ON CONFLICT(ticker, date) DO UPDATE SET {", ".join(f"{x} = excluded.{x}" for x in DAILY_BAR_COLUMNS)},
+                extra = excluded.extra, mirrored = 0, version = daily_bars.version + 1
+        """, rows)
+
+def convertDailyBarRowsToDF(rows):
+
+    records = []
+    for row in rows:
+        record = {'Date': row[1], 'Ticker': row[0]}
+        record.update(zip(DAILY_BAR_COLUMNS, row[2:2+len(DAILY_BAR_COLUMNS)]))
+        record.update(json.loads(row[-1]) if row[-1] else dict())
+        records.append(record)
+
+    return pd.DataFrame(records)
+
+def getDailyBars(tickers=None, start_date=None, end_date=None):
+    '''
+    Returns a dataframe of daily rows (same columns as the HISTORICAL_DATA tab), oldest first,
+    optionally filtered to a list of tickers and/or a range of dates (inclusive, "YYYY-MM-DD")
+    '''
+
+    query = f"SELECT ticker, date, {', '.join(DAILY_BAR_COLUMNS)}, extra FROM daily_bars WHERE 1=1"
+    params = []
+    if tickers is not None:
+        query += f" AND ticker IN ({', '.join('?' for x in tickers)})"
+        params += list(tickers)
+    if start_date is not None:
+        query += " AND date >= ?"
+        params.append(str(start_date))
+    if end_date is not None:
+        query += " AND date <= ?"
+        params.append(str(end_date))
+    query += " ORDER BY ticker, date"
+
+    with connectToStore() as conn:
+        rows = conn.execute(query, params).fetchall()
+
+    return convertDailyBarRowsToDF(rows)
+
+def getLastDailyBarDate(ticker):
+    '''
+    Returns the most recent day ("YYYY-MM-DD") we have a daily row for, or None if we have nothing for this ticker
+    '''
+
+    with connectToStore() as conn:
+        row = conn.execute("SELECT MAX(date) FROM daily_bars WHERE ticker = ?", (ticker,)).fetchone()
+
+    return row[0]
+
+def getUnmirroredDailyBars(limit=5000):
+    '''
+    Returns the daily rows that haven't been mirrored to Google Sheets yet, plus a "version" column to hand back to markDailyBarsMirrored
+    '''
+
+    with connectToStore() as conn:
+        rows = conn.execute(f"""
+            SELECT ticker, date, {", ".join(DAILY_BAR_COLUMNS)}, extra, version FROM daily_bars
+            WHERE mirrored = 0 ORDER BY ticker, date LIMIT ?
+        """, (limit,)).fetchall()
+
+    daily_df = convertDailyBarRowsToDF([x[:-1] for x in rows])
+    if len(daily_df) > 0:
+        daily_df['version'] = [x[-1] for x in rows]
+
+    return daily_df
+
+def markDailyBarsMirrored(daily_df):
+    '''
+    Flags the rows as mirrored - but only the versions that were actually mirrored. A row that was upserted again
+    while the mirror was writing to Google has a newer version and stays unmirrored, so the next run picks it up
+    '''
+
+    with connectToStore() as conn:
+        conn.executemany("UPDATE daily_bars SET mirrored = 1 WHERE ticker = ? AND date = ? AND version = ?",
+                         list(zip(daily_df['Ticker'], daily_df['Date'].astype(str), daily_df['version'].astype(int).tolist())))
+
+
+"""
+------------------------------------
+API CALL LEDGER
+------------------------------------
+"""
+def recordApiCall(api_key_id, endpoint, called_at):
+    '''
+    Writes one row to the ledger of paid API calls. Every process sharing this database file spends from the same ledger
+    '''
+
+    with connectToStore() as conn:
+        conn.execute("INSERT INTO api_calls (api_key_id, endpoint, called_at) VALUES (?, ?, ?)",
+                     (api_key_id, endpoint, called_at.isoformat()))
+
+def countApiCalls(api_key_id, since):
+    '''
+    Returns how many calls have been made with this API key since the given datetime
+    '''
+
+    with connectToStore() as conn:
+        row = conn.execute("SELECT COUNT(*) FROM api_calls WHERE api_key_id = ? AND called_at >= ?",
+                           (api_key_id, since.isoformat())).fetchone()
+
+    return row[0]
+
+def getLastApiCallTime(api_key_id, endpoint):
+    '''
+    Returns the ISO timestamp of the most recent call to this endpoint with this API key, or None if there hasn't been one
+    '''
+
+    with connectToStore() as conn:
+        row = conn.execute("SELECT MAX(called_at) FROM api_calls WHERE api_key_id = ? AND endpoint = ?",
+                           (api_key_id, endpoint)).fetchone()
+
+    return row[0]
+
+
+"""
+------------------------------------
+TWITTER LEDGER
+------------------------------------
+"""
+def recordTwitterAction(action, id, recorded_at):
+    '''
+    Remembers that we did something on Twitter ("retweet" a tweet ID, "follow" a user ID), so we never do it twice
+    '''
+
+    with connectToStore() as conn:
+        conn.execute("INSERT OR IGNORE INTO twitter_actions (action, id, recorded_at) VALUES (?, ?, ?)",
+                     (action, int(id), recorded_at.isoformat()))
+
+def hasTwitterAction(action, id):
+    '''
+    Returns True if we've already done this (a primary key lookup, no matter how big the ledger gets)
+    '''
+
+    with connectToStore() as conn:
+        row = conn.execute("SELECT 1 FROM twitter_actions WHERE action = ? AND id = ?", (action, int(id))).fetchone()
+
+    return row is not None
+
+def countTwitterActions(action, since):
+    '''
+    Returns how many times we've done this since the given datetime
+    '''
+
+    with connectToStore() as conn:
+        row = conn.execute("SELECT COUNT(*) FROM twitter_actions WHERE action = ? AND recorded_at >= ?",
+                           (action, since.isoformat())).fetchone()
+
+    return row[0]
+
+def pruneTwitterActions(before):
+    '''
+    Forgets everything recorded before the given datetime. Returns how many rows were removed
+    '''
+
+    with connectToStore() as conn:
+        return conn.execute("DELETE FROM twitter_actions WHERE recorded_at < ?", (before.isoformat(),)).rowcount
+
+
+"""
+------------------------------------
+KEY/VALUE STATE
+------------------------------------
+"""
+def getStoreValue(key, default=None):
+    '''
+    Returns a small piece of state (stored as JSON) that needs to survive restarts
+    '''
+
+    with connectToStore() as conn:
+        row = conn.execute("SELECT value FROM key_values WHERE key = ?", (key,)).fetchone()
+
+    return json.loads(row[0]) if row is not None else default
+
+def setStoreValue(key, value):
+
+    with connectToStore() as conn:
+        conn.execute("INSERT OR REPLACE INTO key_values (key, value) VALUES (?, ?)", (key, json.dumps(value)))
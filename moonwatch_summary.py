@@ -0,0 +1,138 @@
+'''
+End of day summaries, worked out once per ticker per trading day and shared by every channel (Slack, Twitter, ...)
+Each channel only decides how the summary looks - adding a new one doesn't cost any extra data loads
+'''
+
+import threading
+from dataclasses import dataclass
+from datetime import date
+
+import pandas as pd
+
+import moonwatch_utils as moon
+
+"""
+------------------------------------
+VARIABLES AND STUFF
+------------------------------------
+"""
+_summaries_lock = threading.Lock()
+_summaries = dict()
+
+
+"""
+------------------------------------
+EOD SUMMARY
+------------------------------------
+"""
+@dataclass(frozen=True)
+class EODSummary:
+    ticker: str
+    date: str
+    open: float
+    close: float
+    high: float
+    low: float
+    volume: int
+    volume_rank: int
+    intraday_delta: float
+    intraday_delta_pct: float
+    close_vs_prior_day: float
+    close_vs_prior_day_pct: float
+
+    @property
+    def intraday_direction(self):
+        return 'Up' if self.intraday_delta>0 else 'Down'
+
+    @property
+    def close_vs_prior_day_direction(self):
+        return 'Up' if self.close_vs_prior_day>0 else 'Down'
+
+def convertRowToEODSummary(row):
+
+    return EODSummary(ticker=row['Ticker'],
+                      date=str(row['Date']),
+                      open=round(row['open'],2),
+                      close=round(row['close'],2),
+                      high=round(row['high'],2),
+                      low=round(row['low'],2),
+                      volume=int(row['volume']),
+                      volume_rank=None if pd.isna(row.get('volume_rank')) else int(row['volume_rank']),
+                      intraday_delta=row['Intraday Price Change (Dollars)'],
+                      intraday_delta_pct=row['Intraday Price Change (Percentage)'],
+                      close_vs_prior_day=row['Closing Price Delta from Prior Day (Dollars)'],
+                      close_vs_prior_day_pct=row['Closing Price Delta from Prior Day (Percentage)'])
+
+def getEODSummaries(tickers=None, day=None):
+    '''
+    Returns {ticker: EODSummary} for the watchlist (or the given tickers) on this day ("YYYY-MM-DD", default today).
+    Only the tickers we haven't summarized yet are loaded, all in one go. Tickers with no data for the day are left out
+    '''
+
+    tickers = moon.getWatchlist(tickers)
+    day = day or str(date.today())
+
+    with _summaries_lock:
+        # Yesterday's summaries aren't going to be asked for again
+        for key in [x for x in _summaries if x[1] != day]:
+            del _summaries[key]
+        missing = [x for x in tickers if (x, day) not in _summaries]
+
+    if missing:
+        summary_df = moon.loadHistoricalData(missing, day)
+        with _summaries_lock:
+            for row in summary_df.to_dict('records'):
+                _summaries[(row['Ticker'], day)] = convertRowToEODSummary(row)
+
+    with _summaries_lock:
+        summaries = {x: _summaries[(x, day)] for x in tickers if (x, day) in _summaries}
+
+    for ticker in tickers:
+        if ticker not in summaries:
+            print(f"No historical data for {ticker} on {day} - no EOD summary")
+
+    return summaries
+
+def formatPercent(pct):
+    return str(round(pct*100,1))+"%"
+
+
+"""
+------------------------------------
+RENDERERS
+------------------------------------
+"""
+def renderSlackEODMessage(summary):
+    '''
+    Craft a beautiful and helpful Slack message
+    '''
+
+    return f'''
+    Hello apes! What a day it has been! Here is your summary of ${summary.ticker}'s progress towards the :rocket: moon :rocket: today.
+
+    Open: ${summary.open}
+    Close: ${summary.close} ({summary.intraday_direction} {formatPercent(summary.intraday_delta_pct)} from open; {summary.close_vs_prior_day_direction} {formatPercent(summary.close_vs_prior_day_pct)} from prior close)
+    Today's high: ${summary.high} :rocket:
+    Today's low: ${summary.low} :porg::sweat_drops:
+    Today's trading volume: {summary.volume} (is that a lot? :thinkintense:)
+
+    *The following is not financial advice, I just love the stock:*
+
+    Outlook: Bullish
+    Recommendation: HODL
+    '''
+
+def renderTweetEODMessage(summary):
+    '''
+    Craft a beautiful and helpful tweet
+    '''
+
+    return f'''
+    Hello apes! What a day it has been!!!
+
+    Today ({summary.date}), ${summary.ticker} opened at ${summary.open} and closed at ${summary.close} ({summary.intraday_direction} {formatPercent(summary.intraday_delta_pct)} from open)
+
+    Today's trading volume: {summary.volume} (rank #{summary.volume_rank} across the past year of trading)
+
+    Don't forget to #HODL! #{summary.ticker} #MOASS #Apestrong
+    '''
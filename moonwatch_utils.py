@@ -3,29 +3,49 @@ Functions used for Moonwatch Slack app
 (Does not include functions for using Twitter API)
 '''
 
+import asyncio
 import os
 import json
-import time as t
-import requests
+import threading
 import pandas as pd
 import gspread
 import gspread_dataframe as gd
 from base64 import b64encode
+from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 from datetime import date, datetime, timedelta, time
 from gspread_dataframe import set_with_dataframe
-from PIL import Image
-from selenium import webdriver
 from selenium.common.exceptions import NoSuchElementException, WebDriverException
-from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.webdriver.support.ui import WebDriverWait
+
+import moonwatch_browser as browser
+import moonwatch_budget as budget
+import moonwatch_charts as charts
+import moonwatch_dispatch as dispatch
+import moonwatch_events as events
+import moonwatch_features as features
+import moonwatch_images as images
+import moonwatch_http as http
+import moonwatch_store as store
+import moonwatch_summary as summary
 
 """
 ------------------------------------
 VARIABLES AND STUFF
 ------------------------------------
 """
-KEYFILE = 'service_account_creds.json'
 service_account_creds = os.getenv("SERVICE_ACCOUNT_CREDS")
 worksheet_key = os.getenv("MOONWATCH_WORKSHEET_KEY")
+# Comma-separated list of tickers to keep an eye on, e.g. "GME,AMC"
+watchlist = [x.strip().upper() for x in os.getenv("MOONWATCH_WATCHLIST", "GME").split(",") if x.strip()]
+# How many historical data fetches can run at the same time
+HISTORICAL_FETCH_WORKERS = int(os.getenv("HISTORICAL_FETCH_WORKERS", 5))
+# Prices copied into the local index from the Google Sheet are only trusted for this long - some other process
+# (e.g. the Slack app on another dyno) is the one polling, and it keeps adding newer prices to the sheet
+SHEET_PRICE_MAX_AGE_MINUTES = int(os.getenv("SHEET_PRICE_MAX_AGE_MINUTES", budget.MIN_POLL_MINUTES))
 
 
 """
@@ -33,12 +53,25 @@ worksheet_key = os.getenv("MOONWATCH_WORKSHEET_KEY")
 GENERAL UTILITIES
 ------------------------------------
 """
-def convertEpochToDate(epoch):
-    #timestamp_format = "%Y-%m-%d %H:%m:%S"
-    date_format = "%Y-%m-%d"
-    created_at_datetime = datetime.fromtimestamp(epoch)
-    created_at_date = created_at_datetime.strftime(date_format)
-    return created_at_date
+def getWatchlist(tickers=None):
+    '''
+    Returns the list of tickers a job should run over: the tickers passed in (a single ticker string works too),
+    or the MOONWATCH_WATCHLIST if none were given
+    '''
+
+    if tickers is None:
+        return list(watchlist)
+    elif isinstance(tickers, str):
+        return [tickers]
+    else:
+        return list(tickers)
+
+def checkIfTradingDay():
+    '''
+    Returns a boolean indicating whether today is a trading day (weekdays - no holiday calendar, sorry)
+    '''
+
+    return datetime.today().weekday() < 5
 
 def checkIfTradingHours():
     '''
@@ -63,108 +96,359 @@ def checkIfTradingHours():
 SLACK API
 ------------------------------------
 """
-def post_message_to_slack(text, blocks = None):
+def sendSlackMessage(data):
+    '''
+    Does the actual chat.postMessage call. Raises HTTPError on a 429 (or any other HTTP error), so the dispatcher can retry it later
+    '''
+
+    response = http.post('https://slack.com/api/chat.postMessage', endpoint='slack', data=data)
+    response.raise_for_status()
+    return response
+
+def post_message_to_slack(text, blocks = None, priority = 'default'):
+    '''
+    Queues a message for #gme_moonwatch. It goes out as soon as Slack's rate limit allows, ahead of anything with a lower priority
+    (see moonwatch_dispatch.PRIORITIES). Returns a Future with the response
+    '''
     
     slack_token = os.getenv('SLACK_TOKEN')
     slack_channel = '#gme_moonwatch'
     slack_icon_emoji = ':see_no_evil:'
     slack_user_name = 'moonwatch'
 
-    return requests.post('https://slack.com/api/chat.postMessage', {
+    # Slack's rate limit is per channel
+    return dispatch.send(f'slack:{slack_channel}', sendSlackMessage, {
         'token': slack_token,
         'channel': slack_channel,
         'text': text,
         'icon_emoji': slack_icon_emoji,
         'username': slack_user_name,
         'blocks': json.dumps(blocks) if blocks else None
-    }).json()
+    }, priority = priority, description = 'Slack message')
 
 """
 ------------------------------------
 GOOGLE SHEETS API
 ------------------------------------
 """
+# One Google Sheets client (and one handle per spreadsheet/worksheet) for the whole process, shared by the scheduler threads
+_gsheets_lock = threading.Lock()
+_gsheets_client = None
+_spreadsheets = dict()
+_worksheets = dict()
+
 def authenticateGoogleSheets():
     '''
     Authenticates GCP Service account using credentials JSON stored in environment variable
-    Returns gc object
+    Returns gc object, which is built once and then reused by every job in this process.
+    Credentials are loaded straight from memory (no key file on disk) and the access token refreshes itself when it expires
     '''
 
-     # Authenticate Google service account to access Google Sheets
-    try:
-        with open(KEYFILE, "w") as secret_file:
-            secret_file.write(service_account_creds)
-        gc = gspread.service_account(filename=KEYFILE)
-        os.remove(KEYFILE)
+    global _gsheets_client
 
-    except:
-        print("Google Sheets authentication failed :( :( :(")
+    with _gsheets_lock:
+        if _gsheets_client is None:
+            try:
+                _gsheets_client = gspread.service_account_from_dict(json.loads(service_account_creds))
+            except:
+                print("Google Sheets authentication failed :( :( :(")
+                raise
+
+        return _gsheets_client
+
+def openSpreadsheet(worksheet_key):
+    '''
+    Returns the spreadsheet object for this key, opening it only the first time it's asked for
+    '''
+
+    gc = authenticateGoogleSheets()
+
+    with _gsheets_lock:
+        if worksheet_key not in _spreadsheets:
+            _spreadsheets[worksheet_key] = gc.open_by_key(worksheet_key)
+
+        return _spreadsheets[worksheet_key]
 
-    return gc
+def getWorksheet(worksheet_key, sheet_index):
+    '''
+    Returns the worksheet object for this spreadsheet key & tab index, cached the same way as the spreadsheet itself
+    '''
+
+    sh = openSpreadsheet(worksheet_key)
+
+    with _gsheets_lock:
+        if (worksheet_key, sheet_index) not in _worksheets:
+            _worksheets[(worksheet_key, sheet_index)] = sh.get_worksheet(sheet_index)
+
+        return _worksheets[(worksheet_key, sheet_index)]
 
 def loadGoogleSheetAsDF(worksheet_key, sheet_index):
     
     # Get data from the worksheet
-    gc = authenticateGoogleSheets()
-    sh = gc.open_by_key(worksheet_key)
-    worksheet = sh.get_worksheet(sheet_index)
+    worksheet = getWorksheet(worksheet_key, sheet_index)
     sheet_as_df = gd.get_as_dataframe(worksheet)
     
     return sheet_as_df
 
-def getMostRecentPriceFromSheet(ticker):
+def convertDFToSheetRows(df, header):
+    '''
+    Lines the values of df up with a sheet's column order (anything missing is left blank) and returns a list of rows
+    '''
+
+    return [['' if pd.isna(row.get(column)) else str(row.get(column)) for column in header]
+            for row in df.to_dict('records')]
+
+def getSheetHeader(worksheet, df):
+    '''
+    Returns the header row of the worksheet, adding any columns of df that the sheet doesn't have yet
+    (or writing the whole header if the tab is empty)
+    '''
+
+    header = worksheet.row_values(1)
+    new_columns = [x for x in df.columns if x not in header]
+    if new_columns:
+        header = header + new_columns
+        if len(header) > worksheet.col_count:
+            worksheet.add_cols(len(header) - worksheet.col_count)
+        worksheet.batch_update([{'range': 'A1', 'values': [header]}], value_input_option='USER_ENTERED')
+
+    return header
+
+def appendRowsToGoogleSheet(worksheet_key, sheet_index, new_rows_df):
+    '''
+    Appends the rows of new_rows_df to the bottom of a worksheet without reading the existing data.
+    Only the header row is fetched, so that values land in the right columns no matter how the tab is laid out.
+    '''
+
+    worksheet = getWorksheet(worksheet_key, sheet_index)
+    header = getSheetHeader(worksheet, new_rows_df)
+    rows = convertDFToSheetRows(new_rows_df, header)
+
+    worksheet.append_rows(rows, value_input_option='USER_ENTERED')
+
+def upsertRowsInGoogleSheet(worksheet_key, sheet_index, rows_df, key_columns):
+    '''
+    Writes the rows of rows_df to a worksheet: rows whose key_columns (e.g. Date & Ticker) are already in the sheet
+    are overwritten in place, and the rest are appended to the bottom. All of the updates go out in one batch.
+    Only the header and the key columns are downloaded, never the whole tab
+    '''
+
+    worksheet = getWorksheet(worksheet_key, sheet_index)
+    header = getSheetHeader(worksheet, rows_df)
+
+    # Find the row number of every key that's already in the sheet
+    key_values = [worksheet.col_values(header.index(x)+1)[1:] for x in key_columns]
+    existing_rows = {key: i+2 for i, key in enumerate(zip(*key_values))}
+
+    updates = []
+    new_rows = []
+    last_column = gspread.utils.rowcol_to_a1(1, len(header)).rstrip('1')
+    for key, values in zip(zip(*[rows_df[x].astype(str) for x in key_columns]), convertDFToSheetRows(rows_df, header)):
+        if key in existing_rows:
+            row_number = existing_rows[key]
+            updates.append({'range': f'A{row_number}:{last_column}{row_number}', 'values': [values]})
+        else:
+            new_rows.append(values)
+
+    if updates:
+        worksheet.batch_update(updates, value_input_option='USER_ENTERED')
+    if new_rows:
+        worksheet.append_rows(new_rows, value_input_option='USER_ENTERED')
+
+    print(f"Sheet {sheet_index}: updated {len(updates)} rows, appended {len(new_rows)} rows")
+
+def mirrorStoreToGoogleSheets():
+    '''
+    Pushes everything the local store has that the Google Sheets tabs don't have yet:
+    new price ticks are appended to ALL_PRICES, and new/changed daily rows are upserted into HISTORICAL_DATA.
+    Scheduled in the background so that no job ever waits on Google to save its data
+    '''
+
+    ticks_df = store.getUnmirroredTicks()
+    if len(ticks_df) > 0:
+        print(f"Mirroring {len(ticks_df)} new ticks to Google Sheets")
+        appendRowsToGoogleSheet(worksheet_key, int(os.environ['ALL_PRICES_SHEET_INDEX']), ticks_df)
+        store.markTicksMirrored(ticks_df)
+
+    daily_df = store.getUnmirroredDailyBars()
+    if len(daily_df) > 0:
+        print(f"Mirroring {len(daily_df)} daily rows to Google Sheets")
+        upsertRowsInGoogleSheet(worksheet_key, int(os.environ['HISTORICAL_DATA_SHEET_INDEX']), daily_df.drop(columns=['version']), ['Date','Ticker'])
+        store.markDailyBarsMirrored(daily_df)
+
+def getMostRecentPricesFromSheet(tickers):
+    '''
+    Reads the most recent price for each of these tickers out of the ALL_PRICES tab (slow - downloads the whole tab, once).
+    Also warms up the local price index for these tickers and the rest of the watchlist while we have the tab anyway,
+    so a cold index costs one download for the whole watchlist instead of one per ticker.
+    Returns {ticker: price} for the tickers asked for, None for the ones the tab has nothing for
+    '''
 
-    # Get prices dataframe
     # Load the worksheet as a dataframe
     sheet_index = int(os.environ['ALL_PRICES_SHEET_INDEX'])
-    all_prices_df = loadGoogleSheetAsDF(worksheet_key, sheet_index).sort_values(by=['Timestamp'])
-    all_prices_df = all_prices_df[all_prices_df['Ticker']==ticker]
-    most_recent_price_df = all_prices_df.sort_values('Timestamp',ascending=False).reset_index().loc[0:0][['Timestamp','Price']]
-    most_recent_price = most_recent_price_df['Price'][0]
-    return most_recent_price
+    all_prices_df = loadGoogleSheetAsDF(worksheet_key, sheet_index)
+
+    most_recent_prices = dict()
+    for ticker in dict.fromkeys(list(tickers) + watchlist):
+        ticker_prices_df = all_prices_df[all_prices_df['Ticker']==ticker].dropna(subset=['Timestamp'])
+        if len(ticker_prices_df)==0:
+            most_recent_prices[ticker] = None
+            continue
+
+        # The sheet gives us timestamps the way it displays them, so they need normalizing before they can be compared
+        most_recent_row = ticker_prices_df.loc[ticker_prices_df['Timestamp'].map(store.normalizeTimestamp).idxmax()]
+        most_recent_prices[ticker] = float(most_recent_row['Price'])
+        store.setLatestPrice(ticker, most_recent_row['Timestamp'], most_recent_prices[ticker], source='sheet')
+
+    return {x: most_recent_prices[x] for x in tickers}
+
+def loadHistoricalData(tickers, day):
+    '''
+    Returns the daily rows (HISTORICAL_DATA columns) for these tickers on this day ("YYYY-MM-DD") from the local store.
+    Falls back to the Google Sheet for the tickers the store doesn't have (e.g. fresh dyno with an empty database)
+    '''
+
+    daily_df = store.getDailyBars(tickers, start_date=day, end_date=day)
+    missing = [x for x in tickers if len(daily_df)==0 or x not in set(daily_df['Ticker'])]
+    if len(missing)==0:
+        return daily_df
+
+    print(f"No local historical data for {missing} on {day} - checking the Google Sheet")
+    sheet_index = int(os.environ['HISTORICAL_DATA_SHEET_INDEX'])
+    summary_df = loadGoogleSheetAsDF(worksheet_key, sheet_index)
+    summary_df = summary_df[(summary_df['Date']==day) & (summary_df['Ticker'].isin(missing))]
+    if len(daily_df)==0:
+        return summary_df
+
+    return pd.concat([daily_df, summary_df], ignore_index=True)
+
+def isLatestPriceFresh(latest):
+    '''
+    Whether an entry from the local price index (see store.getLatestPrices) can be trusted as the most recent price.
+    Prices this process polled itself are - nobody else writes prices here. Prices copied from the Google Sheet
+    only are for SHEET_PRICE_MAX_AGE_MINUTES, after which the sheet may well have a newer one
+    '''
+
+    timestamp, price, source, checked_at = latest
+    if source == 'poll':
+        return True
+    if source == 'sheet' and checked_at is not None:
+        return datetime.now() - datetime.fromisoformat(checked_at) < timedelta(minutes=SHEET_PRICE_MAX_AGE_MINUTES)
+
+    return False
+
+def getMostRecentPrices(tickers):
+    '''
+    Returns {ticker: the most recent price recorded for it} (None if there isn't one anywhere).
+    Looks in the local price index first (one query for all of them) and only falls back to the Google Sheet for the tickers
+    the index is cold (or stale, see isLatestPriceFresh) for - with one download of the tab, however many that is
+    '''
+
+    latest_prices = store.getLatestPrices(tickers)
+    most_recent_prices = {x: latest_prices[x][1] for x in tickers if x in latest_prices and isLatestPriceFresh(latest_prices[x])}
+
+    cold_tickers = [x for x in tickers if x not in most_recent_prices]
+    if cold_tickers:
+        print(f"No fresh local price on record for {cold_tickers} - checking the Google Sheet")
+        most_recent_prices.update(getMostRecentPricesFromSheet(cold_tickers))
+
+    return most_recent_prices
 
 """
 ------------------------------------
 YAHOO! FINANCE API
 ------------------------------------
 """
-def getStockPrice(ticker):
+def callRapidAPI(path, querystring):
     '''
-    Returns current stock price for this ticker.
-    This uses my free trial account with rapidAPI.com, which is limited to 500 free calls per month.
-    So we will only check every half hour, and only during trading hours.
+    Calls a Yahoo! Finance endpoint on RapidAPI (e.g. "market/v2/get-quotes") and returns the parsed JSON.
+    Every attempt (including retries) is written to the API budget ledger, and the ledger is checked against the quota RapidAPI reports back
     '''
-    
-    url = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/v2/get-summary"
 
-    querystring = {"symbol":ticker,"region":"US"}
+    url = f"https://apidojo-yahoo-finance-v1.p.rapidapi.com/{path}"
 
     headers = {
             'x-rapidapi-key': os.environ['RAPIDAPI_KEY'],
             'x-rapidapi-host': os.environ['RAPIDAPI_HOST']
         }
-    
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    response_json = json.loads(response.text)
-    price = response_json['price']['regularMarketPrice']['fmt']
-    print(f"The current price of {ticker} is {price}")
-    
-    return price
 
-def getStomnkPriceDataframe(ticker):
+    response = http.get(url, endpoint='rapidapi', headers=headers, params=querystring,
+                        on_attempt=lambda: budget.recordRapidApiCall(path))
+    # RapidAPI's own count of what's left keeps the budget right across restarts and processes
+    budget.recordQuotaHeaders(response.headers)
+    response.raise_for_status()
+
+    return response.json()
+
+@dataclass
+class Quote:
+    '''
+    One symbol's worth of a multi-quote API response
+    '''
+    ticker: str
+    price: float
+    previous_close: float = None
+    change_percent: float = None
+    volume: int = None
+    market_state: str = None
+
+def getStockQuotes(tickers):
+    '''
+    Returns a dict of {ticker: Quote} with the current price of every ticker in the list, using ONE API call.
+    This uses my free trial account with rapidAPI.com, which is limited to 500 free calls per month.
+    So we only check as often as moonwatch_budget says we can afford, and only during trading hours - and we never spend
+    more than one call per check, no matter how many tickers are on the watchlist.
+    '''
+
+    querystring = {"symbols":",".join(tickers),"region":"US"}
+    response_json = callRapidAPI(budget.QUOTES_ENDPOINT, querystring)
+
+    quotes = dict()
+    for result in response_json['quoteResponse']['result']:
+        if result.get('regularMarketPrice') is None:
+            continue
+        quote = Quote(ticker=result['symbol'],
+                      price=result['regularMarketPrice'],
+                      previous_close=result.get('regularMarketPreviousClose'),
+                      change_percent=result.get('regularMarketChangePercent'),
+                      volume=result.get('regularMarketVolume'),
+                      market_state=result.get('marketState'))
+        print(f"The current price of {quote.ticker} is {quote.price}")
+        quotes[quote.ticker] = quote
+
+    missing = [x for x in tickers if x not in quotes]
+    if missing:
+        print(f"No quote came back for {missing} - typo in the watchlist?")
+
+    return quotes
+
+def getStockPrice(ticker):
     '''
-    1. Fetches current stock price of ticker using getStockPrice(ticker)
-    2. Returns a dataframe containing the result along with current timestamp
+    Returns current stock price for this ticker.
+    Only use this for one-off checks - jobs that care about more than one ticker should call getStockQuotes once for all of them
+    '''
+
+    return getStockQuotes([ticker])[ticker].price
+
+def getStomnkPriceDataframe(tickers):
+    '''
+    1. Fetches current stock price of every ticker in the list using getStockQuotes(tickers) (one API call)
+    2. Returns a dataframe containing the results (one row per ticker) along with current timestamp
     '''
 
     if checkIfTradingHours():
-        price = getStockPrice(ticker)
-        output_dict = dict()
-        output_dict['Date']=date.today()
-        output_dict['Timestamp']=datetime.now(tz=None)    
-        output_dict['Ticker']=ticker
-        output_dict['Price']=price
-        new_data_df = pd.DataFrame(output_dict, index=[0])
+        quotes = getStockQuotes(tickers)
+        timestamp = datetime.now(tz=None)
+        rows = []
+        for quote in quotes.values():
+            output_dict = dict()
+            output_dict['Date']=date.today()
+            output_dict['Timestamp']=timestamp
+            output_dict['Ticker']=quote.ticker
+            output_dict['Price']=quote.price
+            output_dict['Change Percent']=quote.change_percent
+            rows.append(output_dict)
+        new_data_df = pd.DataFrame(rows, columns=['Date','Timestamp','Ticker','Price','Change Percent'])
     
         return new_data_df
 
@@ -173,166 +457,252 @@ def getStomnkPriceDataframe(ticker):
         print("Outside trading hours. Chill")
         return None
 
-def createSlackMessage(new_data_df,price_change):
-    price = new_data_df['Price'][0]
+def createSlackMessage(ticker,price,price_change):
 
     if price_change>0.05:
-        message = f":gorilla::rocket::waning_crescent_moon::last_quarter_moon::waning_gibbous_moon::full_moon: ${price}"
+        message = f":gorilla::rocket::waning_crescent_moon::last_quarter_moon::waning_gibbous_moon::full_moon: {ticker} ${price}"
     elif price_change>0.01:
-        message = f":biden_point::rocket: ${price}"        
+        message = f":biden_point::rocket: {ticker} ${price}"        
     elif price_change>0.005:
-        message = f":rocket: ${price}"
+        message = f":rocket: {ticker} ${price}"
     elif price_change>0:
-        message = f":banana: ${price}"
+        message = f":banana: {ticker} ${price}"
     elif price_change<-.01:
-        message = f":porg::sweat_drops: ${price}"
+        message = f":porg::sweat_drops: {ticker} ${price}"
     elif price_change<-.005:
-        message = f":porg: ${price}"
+        message = f":porg: {ticker} ${price}"
     else:
-        message = f":gorilla: ${price}"
+        message = f":gorilla: {ticker} ${price}"
 
     return message   
 
-def updateStonkxData(ticker):
+def postPriceChangeToSlack(event):
     '''
-    Fetch realtime stock price and post a message in Slack.
-    1) Scrape current stock price from Yahoo! finance
-    2) Check to see whether it's changed from the last scrape
-    3a) If price has changed, write a new row to the Google Sheet and send a message to Slack
-    3b) If price is same, do nothing
+    Subscriber for PriceChanged events: posts the new price (with uplifting emoji) to Slack, but only during trading hours
     '''
 
+    if checkIfTradingHours():
+        message = createSlackMessage(event.ticker,event.price,event.price_change)
+        print(f"Slack message: {message}")
+        post_message_to_slack(message, blocks = None, priority = 'price')
+
+def shouldUpdateStonkxData():
+
     if not checkIfTradingHours():
         print("We are outside trading hours. Chill")
-        return
+        return False
     
-    else:
-        # Get df with updated stonk data
-        new_data_df = getStomnkPriceDataframe(ticker)
+    elif not budget.shouldPollNow():
+        print("Saving our API budget for later. HODL")
+        return False
 
-        # We will only add this to the Google Sheet if the price has changed. 
-        # Fetch data from the existing sheet and compare our new dataframe with the most recent row in the Gsheet
+    return True
 
-        # Load the worksheet as a dataframe
-        sheet_index = int(os.environ['ALL_PRICES_SHEET_INDEX'])
-        sheet_as_df = loadGoogleSheetAsDF(worksheet_key, sheet_index).sort_values(by=['Timestamp'])
+def saveStonkxData(new_data_df, previous_prices):
+    '''
+    Compares the fetched prices with the most recent price on record for each ticker ({ticker: price or None}),
+    saves the ones that changed and publishes the events
+    '''
 
-        # Filter to rows for specific ticker
-        sheet_as_df = sheet_as_df[sheet_as_df['Ticker']==ticker]
+    # We will only save rows for prices that have changed
+    changed_rows = []
+    tick_events = []
+    change_events = []
+    biggest_change = 0
+    for i, new_row in new_data_df.iterrows():
+        ticker = new_row['Ticker']
+        new_price = float(new_row['Price'])
+        previous_price = previous_prices.get(ticker)
+        change_percent = None if pd.isna(new_row['Change Percent']) else float(new_row['Change Percent'])
+        if change_percent is not None:
+            biggest_change = max(biggest_change, abs(change_percent))
+        tick_events.append(events.PriceTick(ticker, new_price, new_row['Timestamp'], change_percent))
+
+        if previous_price is None:
+            print(f"First price on record for {ticker}: {new_price}")
+            changed_rows.append(i)
+            continue
 
-        # Compare price values in latest row vs. prior row
-        previous_price = sheet_as_df.iloc[len(sheet_as_df)-1:len(sheet_as_df)].reset_index()['Price'][0]
         previous_price = float(previous_price)
-        new_price = new_data_df['Price'][0]
-        new_price = float(new_price)
         price_change = new_price/previous_price-1
 
-        print(f"new price: {new_price}. Old price: {previous_price}. Price change: {price_change}")
+        print(f"{ticker} new price: {new_price}. Old price: {previous_price}. Price change: {price_change}")
         print(f"Has the price changed? {new_price!=previous_price}")
 
-        # If price has changed, append the new number to the Google Sheet
-        if float(new_price)!=previous_price:
-            print("Adding new data to spreadsheet")
-            updated_df = sheet_as_df.append(new_data_df)
+        if new_price!=previous_price:
+            changed_rows.append(i)
+            change_events.append(events.PriceChanged(ticker, new_price, previous_price, price_change, new_row['Timestamp']))
 
-            # get worksheet object
-            gc = authenticateGoogleSheets()
-            sh = gc.open_by_key(worksheet_key)
-            worksheet = sh.get_worksheet(sheet_index)
+        # If price has not changed, nothing happens
+        else:
+            print(f"{ticker} price has not changed - HODL")
+            # The index now has it straight from the API, even if it came from the Gsheet before
+            store.setLatestPrice(ticker, new_row['Timestamp'], new_price)
 
-            # update worksheet with updated dataframe
-            gd.set_with_dataframe(worksheet, updated_df)
+    # Let the budget planner know how wild today is, so it can speed up or slow down the next checks
+    budget.recordQuoteChange(biggest_change)
 
-            # Post to Slack, but only during trading hours
-            message = createSlackMessage(new_data_df,price_change)
-            print(f"Slack message: {message}")
-            post_message_to_slack(message, blocks = None)
+    # Save the changed rows to the local store. They get appended to the bottom of the Google Sheet
+    # by the mirror job (append-only, so the cost of the write doesn't grow with the size of the sheet)
+    if changed_rows:
+        print("Adding new data to the store")
+        store.insertTicks(new_data_df.loc[changed_rows])
 
-        # If price has not changed, nothing happens
-        else:
-            print("Price has not changed - HODL")
+    # Let the subscribers know (the price is already saved by now, so they can count on the store being up to date)
+    for event in tick_events + change_events:
+        events.publish(event)
 
-        print("All done!")
+    print("All done!")
 
-def updateHistoricalData(ticker):
+async def updateStonkxDataAsync(tickers=None):
     '''
-    Update Google sheets tab containing historical data for {ticker}
-    TODO(): refactor to process a list of tickers instead of just one
+    Fetch realtime stock prices for the watchlist (or the given tickers) and tell everyone who's listening.
+    This is scheduled often, but only actually checks the price when the API budget allows (see moonwatch_budget.shouldPollNow)
+    1) Scrape current stock prices from Yahoo! finance (one API call for all of the tickers)
+    2) Check to see whether each price has changed from the last scrape
+    3a) If a price has changed, write a new row to the local store (mirrored to the Google Sheet) and publish a PriceChanged event
+        (Slack, Twitter etc. subscribe to these - see moonwatch_events)
+    3b) If a price is same, do nothing (other than the PriceTick event that goes out for every price we fetch)
+    Runs on the asyncio scheduler (see moonwatch_app): the quote fetch and the lookup of the most recent prices
+    (one batched lookup for the whole watchlist) run at the same time instead of one after the other
     '''
-    
-    print(f"Updating historical data for {ticker}...")
 
+    if not await asyncio.to_thread(shouldUpdateStonkxData):
+        return
+
+    tickers = getWatchlist(tickers)
+
+    new_data_df, previous_prices = await asyncio.gather(
+        asyncio.to_thread(getStomnkPriceDataframe, tickers),
+        asyncio.to_thread(getMostRecentPrices, tickers)
+    )
+
+    await asyncio.to_thread(saveStonkxData, new_data_df, previous_prices)
+
+def fetchHistoricalPrices(ticker):
+    '''
+    Calls the API to fetch a year of daily prices for {ticker} (the API always sends back the whole year, there's no way to ask for less)
+    Returns a dataframe with Date, Ticker, open, high, low, close, volume, adjclose
+    '''
 
-    # call API to fetch historical data
-    url = "https://apidojo-yahoo-finance-v1.p.rapidapi.com/stock/v3/get-historical-data"
     querystring = {"symbol":ticker,"region":"US"}
-    headers = {
-            'x-rapidapi-key': os.environ['RAPIDAPI_KEY'],
-            'x-rapidapi-host': os.environ['RAPIDAPI_HOST']
-        }
-    response = requests.request("GET", url, headers=headers, params=querystring)
-    historical_data_json = json.loads(response.text)
+    historical_data_json = callRapidAPI("stock/v3/get-historical-data", querystring)
     
     # load response data into a dataframe
-    historical_data_df = pd.DataFrame(historical_data_json['prices'])
-    historical_data_df = historical_data_df.rename(columns={"date":"timestamp_epoch"})
-    historical_data_df['Date'] = [convertEpochToDate(x) for x in historical_data_df['timestamp_epoch']]
-    historical_data_df = historical_data_df.drop(['timestamp_epoch'],axis=1)
-    historical_data_df['Ticker'] = ticker
-
-    # Calculate the rank and percentile of the trading volume for each day, considering the past 52 weeks of data
-    daily_volumes = historical_data_df[['Date','volume']].sort_values('volume')
-    #daily_volume_rank_p52w = daily_volumes.groupby().cumcount()
-    daily_volumes = daily_volumes.reset_index().reset_index()
-    daily_volumes = daily_volumes.rename(columns={"level_0":"volume_rank"})
-    daily_volumes['volume_rank'] = daily_volumes['volume_rank']+1
-    daily_volumes['volume_percentile'] = daily_volumes['volume_rank']/len(daily_volumes)
-
-    daily_volume_ranks_and_percentiles = daily_volumes[['Date','volume_rank','volume_percentile']]
-    historical_data_df = historical_data_df.merge(daily_volume_ranks_and_percentiles,how='inner',on='Date')
-
-    # Add rownums partitioned by ticker. We will use these to get prior day stats
-    rownum = historical_data_df.groupby(['Ticker']).cumcount()
-    historical_data_df['rownum'] = [x for x in rownum]
-
-    # Create "prior day" dataframe with rownums incremented by 1
-    historical_data_df_prior_day = historical_data_df.copy()
-    historical_data_df_prior_day = historical_data_df_prior_day.drop(['Date'],axis=1)
-    historical_data_df_prior_day.columns = [x+' prior day' for x in historical_data_df_prior_day.columns]
-    historical_data_df_prior_day = historical_data_df_prior_day.rename(columns={'Ticker prior day':'Ticker'})
-    historical_data_df_prior_day = historical_data_df_prior_day.rename(columns={'rownum prior day':'rownum'})
-    historical_data_df_prior_day['rownum']=[x-1 for x in historical_data_df_prior_day['rownum']]
-    historical_data_df = historical_data_df.merge(historical_data_df_prior_day,how='inner',on=['Ticker','rownum'])
-    historical_data_df = historical_data_df[['Date'
-                                            ,'Ticker'
-                                            ,'open'
-                                            ,'high'
-                                            ,'low'
-                                            ,'close'
-                                            ,'volume'
-                                            ,'adjclose'
-                                            ,'open prior day'
-                                            ,'high prior day'
-                                            ,'low prior day'
-                                            ,'close prior day'
-                                            ,'volume prior day'
-                                            ,'adjclose prior day'
-                                           ]]
-
-    # Add a few more calculated fields
-    historical_data_df['Intraday Price Change (Dollars)'] = historical_data_df['close'] - historical_data_df['open']
-    historical_data_df['Intraday Price Change (Percentage)'] = [(historical_data_df['close'][i]/historical_data_df['open'][i])-1 for i in range(len(historical_data_df['close']))] 
-    historical_data_df['Closing Price Delta from Prior Day (Dollars)'] = historical_data_df['close'] - historical_data_df['close prior day']
-    historical_data_df['Closing Price Delta from Prior Day (Percentage)'] = [(historical_data_df['close'][i]/historical_data_df['close prior day'][i])-1 for i in range(len(historical_data_df['close']))] 
-
-    # update the Google Sheets worksheet
-    sheet_index = int(os.environ['HISTORICAL_DATA_SHEET_INDEX'])
-    gc = authenticateGoogleSheets()
-    sh = gc.open_by_key(worksheet_key)
-    historical_data_worksheet = sh.get_worksheet(sheet_index)
-    gd.set_with_dataframe(historical_data_worksheet, historical_data_df)
+    prices_df = pd.DataFrame(historical_data_json['prices'])
+    prices_df = prices_df.rename(columns={"date":"timestamp_epoch"})
+    prices_df['Date'] = features.convertEpochsToDates(prices_df['timestamp_epoch'])
+    prices_df = prices_df.drop(['timestamp_epoch'],axis=1)
+    prices_df['Ticker'] = ticker
+    prices_df = prices_df[['Date','Ticker','open','high','low','close','volume','adjclose']]
+
+    return prices_df
+
+def fetchHistoricalPricesForTickers(tickers):
+    '''
+    Fetches the historical prices of every ticker at the same time on a small pool of workers,
+    so the whole batch takes about as long as the slowest single fetch.
+    Never starts more fetches than the API budget has calls left for. Tickers that fail are skipped (and printed)
+    Returns a dict of {ticker: prices dataframe}
+    '''
+
+    remaining_quota = budget.getRemainingQuota()
+    if remaining_quota < len(tickers):
+        print(f"Only {remaining_quota} API calls left this month - skipping historical data for {tickers[remaining_quota:]}")
+        tickers = tickers[:remaining_quota]
+
+    prices_by_ticker = dict()
+    if len(tickers)==0:
+        return prices_by_ticker
+
+    with ThreadPoolExecutor(max_workers=min(HISTORICAL_FETCH_WORKERS, len(tickers))) as pool:
+        futures = {pool.submit(fetchHistoricalPrices, ticker): ticker for ticker in tickers}
+        for future in as_completed(futures):
+            ticker = futures[future]
+            try:
+                prices_by_ticker[ticker] = future.result()
+            except Exception as e:
+                print(f"Failed to fetch historical data for {ticker}: {e}")
+
+    return prices_by_ticker
+
+def updateHistoricalData(tickers=None, full_refresh=False):
+    '''
+    Update the historical data for the watchlist (or the given tickers) in the local store (mirrored to the HISTORICAL_DATA Google Sheets tab)
+    All of the tickers are fetched in parallel, then their calculated fields are worked out together and saved in one write.
+    By default this is incremental: only the days we don't have yet (plus the last stored day, in case it was saved mid-session)
+    are saved, with their calculated fields worked out from the stored prior day (and the past 52 weeks of stored volume for the volume rank).
+    full_refresh=True rewrites the whole year, which also picks up adjclose revisions after splits & dividends (scheduled weekly, see moonwatch_app)
+    '''
     
-    print(f"Historical data for {ticker} updated successfully")
+    tickers = getWatchlist(tickers)
+    print(f"Updating historical data for {tickers}...")
+
+    prices_by_ticker = fetchHistoricalPricesForTickers(tickers)
+
+    # Keep only the days that are newer than what we already have
+    frames = []
+    last_stored_dates = dict()
+    for ticker, prices_df in prices_by_ticker.items():
+        last_stored_date = None if full_refresh else store.getLastDailyBarDate(ticker)
+        if last_stored_date is None:
+            frames.append(prices_df)
+            continue
+
+        # The last stored day is always taken again: it may have been saved mid-session (e.g. by a restart during
+        # trading hours) with the partial day's close & volume
+        new_prices_df = prices_df[prices_df['Date']>=last_stored_date]
+        if len(new_prices_df)==0:
+            print(f"No prices for {ticker} since the last stored day ({last_stored_date})")
+            continue
+
+        # The new days get compared against the stored prior day, and their volume gets ranked against the past 52 weeks
+        window_start = str(datetime.strptime(new_prices_df['Date'].min(), "%Y-%m-%d").date() - timedelta(weeks=52))
+        stored_prices_df = store.getDailyBars([ticker], start_date=window_start, end_date=last_stored_date)
+        stored_prices_df = stored_prices_df[stored_prices_df['Date']<last_stored_date]
+        stored_prices_df = stored_prices_df[['Date','Ticker','open','high','low','close','volume','adjclose']]
+        frames += [stored_prices_df, new_prices_df]
+        last_stored_dates[ticker] = last_stored_date
+
+    if len(frames)==0:
+        print("Nothing new to save")
+        return
+
+    # Work out the calculated fields for every ticker in one pass, then drop the days we already had
+    historical_data_df = features.calculateHistoricalFeatures(pd.concat(frames, ignore_index=True))
+    already_stored = historical_data_df['Date'] < historical_data_df['Ticker'].map(last_stored_dates).fillna('')
+    historical_data_df = historical_data_df[~already_stored]
+
+    # save to the local store in one go - the mirror job upserts the rows into the Google Sheets worksheet in one batch
+    store.upsertDailyBars(historical_data_df)
+    
+    print(f"Historical data updated successfully ({len(historical_data_df)} rows saved for {historical_data_df['Ticker'].nunique()} tickers)")
+
+def catchUpHistoricalData(tickers=None):
+    '''
+    Runs once at startup (see moonwatch_app): updates the historical data for the tickers the store is behind on
+    (nothing stored since the last weekday, e.g. a fresh dyno with an empty database), if the API budget can spare a call for each.
+    Failures are only logged - the scheduled update after market close will have another go
+    '''
+
+    last_weekday = date.today() - timedelta(days=1)
+    while last_weekday.weekday() >= 5:
+        last_weekday -= timedelta(days=1)
+
+    behind = [x for x in getWatchlist(tickers) if (store.getLastDailyBarDate(x) or '') < str(last_weekday)]
+    if len(behind)==0:
+        print("Historical data is up to date - no catching up to do")
+        return
+
+    try:
+        remaining_quota = budget.getRemainingQuota()
+        if remaining_quota < len(behind):
+            print(f"Historical data is behind for {behind}, but only {remaining_quota} API calls are left this month - leaving it to the scheduled update")
+            return
+
+        updateHistoricalData(behind)
+    except Exception as e:
+        print(f"Couldn't catch up on historical data for {behind}: {e}")
 
 """
 ------------------------------------------------------------------------
@@ -341,54 +711,42 @@ SELENIUM
 """
 def getScreenshot(ticker):
     '''
-    Given a specific ticker, opens Google search page and grabs a screenshot
-    Returns the filename of the resulting image
+    Given a specific ticker, opens Google search page and grabs a screenshot of just the stock chart
+    Borrows a warm Chrome from the browser pool instead of starting a new one every time
+    Waits (up to browser.CHART_WAIT_SECONDS) for the chart to show up instead of sleeping, and raises TimeoutException if it never does
+    Returns the screenshot as PNG bytes (nothing is written to disk)
     '''
 
-    CHROMEDRIVER_PATH = os.environ.get('CHROMEDRIVER_PATH', '/usr/local/bin/chromedriver')
-    GOOGLE_CHROME_BIN = os.environ.get('GOOGLE_CHROME_BIN', '/usr/bin/google-chrome')
-    filename = f'{ticker}_screenshot.png'
-
-    options = Options()
-    options.binary_location = GOOGLE_CHROME_BIN
-    options.add_argument('--disable-gpu')
-    options.add_argument('--no-sandbox')
-    options.add_argument("--window-size=1920,1080")
-    options.headless = True
-
-    driver = webdriver.Chrome(executable_path=CHROMEDRIVER_PATH , chrome_options=options)
-    print("WOW the driver works")
-    url = f'https://www.google.com/search?q={ticker}+stock'
-    driver.get(url)
-    print("got the URL. Waiting 2 seconds...")
-    t.sleep(2)
-    print("OK grabbing a screenshot now")
-    driver.save_screenshot(filename)
-    print("Closing the webdriver")
-    driver.close()
-
-    return filename
+    with browser.browser_pool.borrow() as driver:
+        url = f'https://www.google.com/search?q={ticker}+stock'
+        driver.get(url)
+        print("got the URL. Waiting for the chart...")
+        chart = WebDriverWait(driver, browser.CHART_WAIT_SECONDS).until(
+            EC.visibility_of_element_located((By.CSS_SELECTOR, browser.CHART_SELECTOR))
+        )
+        print("OK grabbing a screenshot of the chart now")
+        return chart.screenshot_as_png
 
 """
 ------------------------------------------------------------------------
 PYTHON IMAGE LIBRARY
 ------------------------------------------------------------------------
 """
-def cropImage(filename):
-    # Opens a image in RGB mode
-    im = Image.open(filename)
-    # Setting the points for cropped image
-    left = 185
-    top = 350
-    right = 830
-    bottom = 690
-    
-    # Cropped image of above dimension
-    # (It will not change original image)
-    im1 = im.crop((left, top, right, bottom))
-    
-    # Overwrite the file with the new cropped version
-    im1 = im1.save(filename)
+def getTrendImage(ticker, window='1d'):
+    '''
+    Draws the trend chart for {ticker} from our own data
+    Falls back to the Google screenshot when we don't have enough data stored to draw it ourselves
+    Returns the image as PNG bytes
+    '''
+
+    try:
+        buffer = BytesIO()
+        charts.renderTrendChart(ticker, window).save(buffer, format='PNG')
+        print(f"Trend chart drawn for {ticker} ({window})")
+        return buffer.getvalue()
+    except charts.NotEnoughDataError as e:
+        print(f"{e} - using Selenium to fetch a screenshot instead")
+        return getScreenshot(ticker)
 
 """
 ------------------------------------------------------------------------
@@ -399,19 +757,28 @@ def uploadFileToImgur(filename):
     '''
     Uploads file to imgur and returns the URL where it has been uploaded
     '''
+
+    with open(filename, 'rb') as f:
+        return uploadImageToImgur(f.read(), filename)
+
+def uploadImageToImgur(data, name):
+    '''
+    Uploads an image (bytes) to imgur and returns the URL where it has been uploaded
+    '''
     
     client_id = os.getenv('IMGUR_CLIENT_ID')
     headers = {"Authorization": f"Client-ID {client_id}"}
     api_key = os.getenv('IMGUR_CLIENT_ID')
     url = "https://api.imgur.com/3/upload.json"
-    j1 = requests.post(
+    j1 = http.post(
         url, 
+        endpoint = 'imgur',
         headers = headers,
         data = {
             'key': api_key, 
-            'image': b64encode(open(f'{filename}', 'rb').read()),
+            'image': b64encode(data),
             'type': 'base64',
-            'name': filename,
+            'name': name,
             'title': 'GME stomnks (not financial advice)'
         }
     )
@@ -430,69 +797,21 @@ def uploadFileToImgur(filename):
 CRAFTING BEAUTIFUL MESSAGES TO DELIVER IN SLACK
 ------------------------------------------------------------------------
 """
-def postEODStatusUpdate(ticker):
+def postEODStatusUpdate(tickers=None):
     '''
-    For a given ticker, post a status update to #gme_moonwatch summarizing the day's trading stats
+    For each ticker on the watchlist (or the given tickers), post a status update to #gme_moonwatch summarizing the day's trading stats
     This will be scheduled to run at the end of every trading day
     '''
-    
-    # Load the worksheet as a dataframe
-
-    sheet_index = int(os.environ['HISTORICAL_DATA_SHEET_INDEX'])
-    summary_df = loadGoogleSheetAsDF(worksheet_key, sheet_index)
-        
-    # Filter summary to selected ticker & today's date
-    today = str(date.today())
-    today_summary = summary_df[(summary_df['Date']==today) & (summary_df['Ticker']==ticker)]
-    
-    # Extract metrics from the summary table
-    trading_open = round(today_summary['open'][0],2)
-    trading_close = round(today_summary['close'][0],2)
-    trading_high = round(today_summary['high'][0],2)
-    trading_low = round(today_summary['low'][0],2)
-    trading_volume = today_summary['volume'][0]
-    
-    trading_intraday_delta = today_summary['Intraday Price Change (Dollars)'][0]
-    trading_intraday_delta_pct = today_summary['Intraday Price Change (Percentage)'][0]
-    trading_intraday_delta_pct = str(round(trading_intraday_delta_pct*100,1))+"%"
-    trading_close_vs_prior_day = today_summary['Closing Price Delta from Prior Day (Dollars)'][0]
-    trading_close_vs_prior_day_pct = today_summary['Closing Price Delta from Prior Day (Percentage)'][0]
-    trading_close_vs_prior_day_pct = str(round(trading_close_vs_prior_day_pct*100,1))+"%"
-    
-    if trading_intraday_delta>0:
-        trading_intraday_delta_direction='Up'
-    else:
-        trading_intraday_delta_direction='Down'
-        
-    if trading_close_vs_prior_day>0:
-        trading_close_vs_prior_day_direction='Up'
-    else:
-        trading_close_vs_prior_day_direction='Down'    
-        
-    # Craft a beautiful and helpful Slack message
-    EOD_summary_message = f'''
-    Hello apes! What a day it has been! Here is your summary of our progress towards the :rocket: moon :rocket: today.
-    
-    Open: ${trading_open}
-    Close: ${trading_close} ({trading_intraday_delta_direction} {trading_intraday_delta_pct} from open; {trading_close_vs_prior_day_direction} {trading_close_vs_prior_day_pct} from prior close)
-    Today's high: ${trading_high} :rocket:
-    Today's low: ${trading_low} :porg::sweat_drops:
-    Today's trading volume: {trading_volume} (is that a lot? :thinkintense:)
-    
-    *The following is not financial advice, I just love the stock:*
-    
-    Outlook: Bullish
-    Recommendation: HODL
-    '''
-    
-    # Update slack!    
 
-    if checkIfTradingHours():
-        print("Sending EOD summary message to Slack")
-        post_message_to_slack(EOD_summary_message, blocks = None)
-    else:
+    if not checkIfTradingDay():
+        print("No EOD summary on non-trading days!")
         return
 
+    # The summaries are shared with the Twitter bot, so whoever asks first does the loading
+    for ticker, eod_summary in summary.getEODSummaries(tickers).items():
+        print(f"Sending {ticker} EOD summary message to Slack")
+        post_message_to_slack(summary.renderSlackEODMessage(eod_summary), blocks = None, priority = 'eod')
+
 def postGoodMorningMessage():
     '''
     Just a friendly greeting to start the trading day
@@ -513,27 +832,23 @@ def postGoodMorningMessage():
     # Update slack!    
     if checkIfTradingHours():
         print("Sending good morning message to Slack")
-        post_message_to_slack(greeting_message, blocks = None)
+        post_message_to_slack(greeting_message, blocks = None, priority = 'greeting')
     else:
         return
 
 
 def postTrendImage(ticker):
 
-    if checkIfTradingHours():
-        # Use Selenium to save a screenshot
-        print("Using Selenium to fetch a screenshot")
-        filename = getScreenshot(ticker)
-
-        # Crop the screenshot to show only the cute trend chart
-        print(f"Screenshot saved: {filename}. Cropping image and uploading to Imgur...")
-        cropImage(filename)
+    # Runs midday and again after the close (the post-close runs on both channels share the closing image, see moonwatch_images)
+    if checkIfTradingDay():
+        # Rendered once per slot and shared with the Twitter bot (and so is the Imgur upload)
+        image = images.getTrendImage(ticker)
         try:
-            imgur_url = uploadFileToImgur(filename)
+            imgur_url = images.getUpload(image, 'imgur', lambda x: uploadImageToImgur(x.data, x.name))
             print(f"Imgur upload success! URL: {imgur_url}. Posting to slack babyyy")
             image_message = f"<{imgur_url}|.>"
-            post_message_to_slack(image_message, blocks = None)
+            post_message_to_slack(image_message, blocks = None, priority = 'trend')
         except:
             print(f"Imgur upload failed :(")
     else:
-        print("We are outside trading hours - chill")
\ No newline at end of file
+        print("No trend images on non-trading days!")
\ No newline at end of file
@@ -0,0 +1,127 @@
+import os
+import sys
+import threading
+import time as t
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import moonwatch_dispatch as dispatch
+
+
+class FakeResult:
+    def __init__(self, headers=None):
+        self.headers = headers or dict()
+
+def makeRateLimitError(headers):
+    response = requests.Response()
+    response.status_code = 429
+    response.headers.update(headers)
+    return requests.exceptions.HTTPError("429 Too Many Requests", response=response)
+
+def test_sends_go_out_in_priority_order():
+    dispatcher = dispatch.Dispatcher()
+    started = threading.Event()
+    release = threading.Event()
+    sent = []
+
+    def blockingSend():
+        started.set()
+        release.wait(5)
+
+    # Hold the worker up so the rest of the sends queue behind it
+    dispatcher.send('test', blockingSend)
+    assert started.wait(5)
+    futures = [dispatcher.send('test', sent.append, priority, priority=priority)
+               for priority in ['retweet', 'default', 'eod', 'greeting', 'price']]
+    release.set()
+
+    for future in futures:
+        future.result(timeout=5)
+    assert sent == ['eod', 'price', 'default', 'greeting', 'retweet']
+
+def test_slow_endpoint_does_not_hold_up_the_others():
+    dispatcher = dispatch.Dispatcher()
+    release = threading.Event()
+
+    slow = dispatcher.send('slow', release.wait, 5)
+    fast = dispatcher.send('fast', lambda: 'sent')
+
+    assert fast.result(timeout=2) == 'sent'
+    assert not slow.done()
+    release.set()
+    assert slow.result(timeout=5) is True
+
+def test_rate_limited_send_is_queued_again():
+    dispatcher = dispatch.Dispatcher()
+    calls = []
+
+    def rateLimitedOnce():
+        calls.append(t.monotonic())
+        if len(calls) == 1:
+            raise makeRateLimitError({'Retry-After': '1'})
+        return 'sent'
+
+    future = dispatcher.send('test', rateLimitedOnce)
+
+    assert future.result(timeout=5) == 'sent'
+    assert len(calls) == 2
+    # It waited as long as it was told to
+    assert calls[1] - calls[0] >= 0.9
+
+def test_send_fails_after_max_attempts(monkeypatch):
+    monkeypatch.setattr(dispatch, 'MAX_ATTEMPTS', 2)
+    dispatcher = dispatch.Dispatcher()
+    calls = []
+
+    def alwaysRateLimited():
+        calls.append(1)
+        raise makeRateLimitError({'Retry-After': '0'})
+
+    future = dispatcher.send('test', alwaysRateLimited)
+
+    assert isinstance(future.exception(timeout=5), requests.exceptions.HTTPError)
+    assert len(calls) == 2
+
+def test_other_failures_are_not_retried():
+    dispatcher = dispatch.Dispatcher()
+    calls = []
+
+    def broken():
+        calls.append(1)
+        raise ValueError("nope")
+
+    assert isinstance(dispatcher.send('test', broken).exception(timeout=5), ValueError)
+    assert len(calls) == 1
+
+def test_bucket_pauses_on_headers():
+    now = t.monotonic()
+
+    bucket = dispatch.TokenBucket(5, 1)
+    bucket.updateFromHeaders({'Retry-After': '30'}, now)
+    assert 29 <= bucket.getWaitSeconds(now) <= 30
+
+    bucket = dispatch.TokenBucket(5, 1)
+    bucket.updateFromHeaders({'x-rate-limit-remaining': '0', 'x-rate-limit-reset': str(int(t.time()) + 60)}, now)
+    assert 55 <= bucket.getWaitSeconds(now) <= 60
+
+    bucket = dispatch.TokenBucket(5, 1)
+    bucket.updateFromHeaders({'x-rate-limit-remaining': '3'}, now)
+    assert bucket.tokens == 3
+    assert bucket.getWaitSeconds(now) == 0
+
+def test_response_headers_pause_the_endpoint():
+    dispatcher = dispatch.Dispatcher()
+    calls = []
+
+    def sendWithHeaders():
+        calls.append(t.monotonic())
+        return FakeResult({'Retry-After': '1'})
+
+    first = dispatcher.send('test', sendWithHeaders)
+    first.result(timeout=5)
+    second = dispatcher.send('test', sendWithHeaders)
+    second.result(timeout=5)
+
+    assert calls[1] - calls[0] >= 0.9
@@ -0,0 +1,56 @@
+import os
+import sys
+
+import pandas as pd
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import moonwatch_features as features
+
+
+def makePrices(ticker, dates, volumes, closes=None):
+    closes = closes or [10 + i for i in range(len(dates))]
+    return pd.DataFrame({
+        'Date': dates,
+        'Ticker': ticker,
+        'open': [x - 1 for x in closes],
+        'high': [x + 1 for x in closes],
+        'low': [x - 2 for x in closes],
+        'close': closes,
+        'volume': volumes,
+        'adjclose': closes,
+    })
+
+def test_calculateHistoricalFeatures_prior_day_and_changes():
+    prices_df = makePrices('GME', ['2021-06-01', '2021-06-02', '2021-06-03'], [100, 300, 200], closes=[10, 12, 9])
+
+    features_df = features.calculateHistoricalFeatures(prices_df)
+
+    # The oldest day has no prior day, so it's dropped
+    assert list(features_df['Date']) == ['2021-06-02', '2021-06-03']
+    assert list(features_df.columns) == features.HISTORICAL_COLUMNS
+    assert list(features_df['close prior day']) == [10, 12]
+    assert list(features_df['Closing Price Delta from Prior Day (Dollars)']) == [2, -3]
+    assert features_df['Closing Price Delta from Prior Day (Percentage)'].iloc[0] == pytest.approx(0.2)
+    assert list(features_df['Intraday Price Change (Dollars)']) == [1, 1]
+
+def test_calculateHistoricalFeatures_volume_rank():
+    prices_df = makePrices('GME', ['2021-06-01', '2021-06-02', '2021-06-03', '2021-06-04'], [100, 300, 200, 300])
+
+    features_df = features.calculateHistoricalFeatures(prices_df)
+
+    # Ranked against every day so far (including the dropped oldest day), ties share the best rank
+    assert list(features_df['volume_rank']) == [1, 2, 1]
+    assert list(features_df['volume_percentile']) == pytest.approx([2/2, 2/3, 4/4])
+
+def test_calculateHistoricalFeatures_volume_rank_window_and_tickers():
+    # The huge day is more than 52 weeks before the last day, so it no longer counts against it
+    gme_df = makePrices('GME', ['2020-01-02', '2020-06-01', '2021-01-04'], [1000, 10, 20])
+    amc_df = makePrices('AMC', ['2021-01-04', '2021-01-05'], [5, 1])
+
+    features_df = features.calculateHistoricalFeatures(pd.concat([gme_df, amc_df.iloc[::-1]], ignore_index=True))
+
+    assert list(features_df['Ticker']) == ['AMC', 'GME', 'GME']
+    assert list(features_df['volume_rank']) == [2, 2, 1]
+    assert list(features_df['volume_percentile']) == pytest.approx([1/2, 1/2, 2/2])
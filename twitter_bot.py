@@ -1,54 +1,31 @@
+import moonwatch_events as events
 import twitter_functions as tw
-import time as t
-from apscheduler.schedulers.background import BackgroundScheduler
-from apscheduler.executors.pool import ThreadPoolExecutor
 from apscheduler.triggers.cron import CronTrigger
 
+def registerJobs(scheduler):
+    '''
+    Adds the Twitter bot's jobs to the scheduler, and subscribes it to price changes.
+    The prices it tweets come from the shared price checks (see moonwatch_app.registerDataJobs), so this doesn't fetch anything on its own
+    '''
 
-# 1. Define the actuator
-executors = {
-    "default":ThreadPoolExecutor(max_workers=10)
-}
+    # Make sure we can actually tweet before signing up for anything
+    if not tw.verifyTwitterCredentials():
+        print("Not starting the Twitter bot")
+        return
 
-# Functions setup
-
-def main():
-
-    tw.tweetEODSummary('GME')
-
-    # Set up scheduler tasks
-    scheduler = BackgroundScheduler(executors=executors)
-
-    # Tweet price updates every half hour (trading hours only)
-    scheduler.add_job(tw.tweetMostRecentPrice, CronTrigger.from_crontab('1 * * * *'), args=['GME'])
-    scheduler.add_job(tw.tweetMostRecentPrice, CronTrigger.from_crontab('31 * * * *'), args=['GME'])
+    # Tweet price updates for the watchlist as soon as they're fetched (trading hours only, at most every half hour per ticker)
+    events.subscribe(events.PriceChanged, tw.tweetPriceChange, tw.shouldTweetPriceChange)
 
     # Post full trend and metrics at midday and market close
     scheduler.add_job(tw.tweetTrendImage, CronTrigger.from_crontab('0 17 * * *'), args=["GME"]) 
     scheduler.add_job(tw.tweetTrendImage, CronTrigger.from_crontab('6 21 * * *'), args=["GME"]) 
 
     # Post summary at EOD
-    scheduler.add_job(tw.tweetEODSummary, CronTrigger.from_crontab('5 21 * * *'), args=["GME"]) 
-
-    # Scan for high-engagement tweets every 15 minutes
-    scheduler.add_job(tw.retweetHighEngagementTweet, CronTrigger.from_crontab('5 * * * *'), args=['#GME'])
-    scheduler.add_job(tw.retweetHighEngagementTweet, CronTrigger.from_crontab('20 * * * *'), args=['#MOASS'])
-    scheduler.add_job(tw.retweetHighEngagementTweet, CronTrigger.from_crontab('35 * * * *'), args=['#gme'])
-    scheduler.add_job(tw.retweetHighEngagementTweet, CronTrigger.from_crontab('50 * * * *'), args=['#moass'])
+    scheduler.add_job(tw.tweetEODSummary, CronTrigger.from_crontab('5 21 * * *'), args=None) 
 
-    # Let 'er rip
-    scheduler.start()
-
-    try:
-        # This is here to simulate application activity (which keeps the main thread alive).
-        while True:
-            t.sleep(2)
-
-    except (KeyboardInterrupt, SystemExit):
-        scheduler.shutdown() 
+    # Scan all the hashtags for high-engagement tweets once an hour, in one search
+    scheduler.add_job(tw.retweetHighEngagementTweets, CronTrigger.from_crontab('5 * * * *'), args=None)
 
 if __name__ == "__main__":
-    main()  
-
-
-
+    import moonwatch_app
+    moonwatch_app.main(channels=['twitter'])
@@ -1,10 +1,14 @@
-import itertools
-import json
+import heapq
 import os
-import pandas as pd
+import threading
 import tweepy
-from datetime import date, datetime, timedelta, time
+from datetime import date, datetime, timedelta, time, timezone
+from io import BytesIO
 
+import moonwatch_dispatch as dispatch
+import moonwatch_images as images
+import moonwatch_store as store
+import moonwatch_summary as summary
 import moonwatch_utils as moon
 
 # dict for mapping emojis to unicode characters, to make my life easier
@@ -20,6 +24,47 @@ emoji = {
     "huffy":"\U0001F624"
 }
 
+# Price tweets go out at most this often per ticker
+PRICE_TWEET_MIN_MINUTES = int(os.getenv("PRICE_TWEET_MIN_MINUTES", 30))
+_price_tweets_lock = threading.Lock()
+_last_price_tweets = dict()
+
+# One Twitter client for the whole process (see twitterAuthenticate)
+_twitter_api_lock = threading.Lock()
+_twitter_api = None
+_dispatch_apis = dict() # dispatcher endpoint -> API object, see getDispatchApi
+
+# Hashtag searches ask for full pages and stop after this many tweets or this many seconds, whichever comes first
+SEARCH_PAGE_SIZE = 100
+SEARCH_MAX_RESULTS = int(os.getenv("TWITTER_SEARCH_MAX_RESULTS", 500))
+SEARCH_MAX_SECONDS = int(os.getenv("TWITTER_SEARCH_MAX_SECONDS", 30))
+
+# Retweets & follows are remembered (in the local store) for this long
+LEDGER_RETENTION_DAYS = int(os.getenv("TWITTER_LEDGER_RETENTION_DAYS", 30))
+# Twitter's error code for "You have already retweeted this Tweet"
+ALREADY_RETWEETED = 327
+
+# Hashtags to look for retweets in (searches are case-insensitive, so "#GME" and "#gme" are the same search)
+RETWEET_QUERIES = [x.strip() for x in os.getenv("TWITTER_RETWEET_QUERIES", "#GME,#MOASS").split(",") if x.strip()]
+# How many of the best tweets to retweet each hour, and never more than this many in a day
+RETWEETS_PER_RUN = int(os.getenv("TWITTER_RETWEETS_PER_RUN", 2))
+DAILY_RETWEET_CAP = int(os.getenv("TWITTER_DAILY_RETWEET_CAP", 24))
+# Twitter's limit on the length of a search query
+MAX_QUERY_LENGTH = 500
+
+# Tweets that weren't good enough to retweet yet are looked up again on later runs (the search itself only sees new tweets),
+# as long as they're less than RECHECK_HOURS old. Only the RECHECK_MAX_TWEETS most retweeted are kept - one lookup call's worth
+RECHECK_KEY = "twitter_recheck_tweets"
+RECHECK_HOURS = float(os.getenv("TWITTER_RECHECK_HOURS", 6))
+RECHECK_LOOKUP_SIZE = 100
+RECHECK_MAX_TWEETS = int(os.getenv("TWITTER_RECHECK_MAX_TWEETS", RECHECK_LOOKUP_SIZE))
+
+# How retweet candidates are ranked: score = (retweets * RETWEET_WEIGHT + likes * LIKE_WEIGHT), halved for every
+# RECENCY_HALF_LIFE_HOURS of the tweet's age (0 = age doesn't matter). The defaults rank by retweet count alone
+RETWEET_WEIGHT = float(os.getenv("TWITTER_RANK_RETWEET_WEIGHT", 1.0))
+LIKE_WEIGHT = float(os.getenv("TWITTER_RANK_LIKE_WEIGHT", 0.0))
+RECENCY_HALF_LIFE_HOURS = float(os.getenv("TWITTER_RANK_HALF_LIFE_HOURS", 0))
+
 def test_function():
     print("yaaaay")
 
@@ -27,57 +72,125 @@ def twitterAuthenticate():
     
     '''
     Returns an API object to do Twittering
+    It's created the first time it's asked for and then shared by every job for the life of the process
     
     Input: none BAYBEE
     Output: returns API object
     '''
-    # get twitter auth creds
-    CONSUMER_KEY = os.environ["TWITTER_CONSUMER_KEY"]
-    CONSUMER_SECRET = os.environ["TWITTER_CONSUMER_SECRET"]
-    ACCESS_TOKEN = os.environ["TWITTER_ACCESS_TOKEN"]
-    ACCESS_TOKEN_SECRET = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
-    
-    # Authenticate to Twitter
-    auth = tweepy.OAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
-    auth.set_access_token(ACCESS_TOKEN, ACCESS_TOKEN_SECRET)
-    
-    # Create API object
-    api = tweepy.API(auth)
+
+    global _twitter_api
+
+    with _twitter_api_lock:
+        if _twitter_api is None:
+            # get twitter auth creds
+            CONSUMER_KEY = os.environ["TWITTER_CONSUMER_KEY"]
+            CONSUMER_SECRET = os.environ["TWITTER_CONSUMER_SECRET"]
+            ACCESS_TOKEN = os.environ["TWITTER_ACCESS_TOKEN"]
+            ACCESS_TOKEN_SECRET = os.environ["TWITTER_ACCESS_TOKEN_SECRET"]
+            
+            # Authenticate to Twitter
+            auth = tweepy.OAuthHandler(CONSUMER_KEY, CONSUMER_SECRET)
+            auth.set_access_token(ACCESS_TOKEN, ACCESS_TOKEN_SECRET)
+            
+            # Create API object
+            _twitter_api = tweepy.API(auth)
     
-    return api
+    return _twitter_api
 
-def convertTweetResponseToDictList(tweetResponse):
-    output_list = []
-    for i in range(len(tweetResponse)):
-        tweet_object = tweetResponse[i]
-        json_str = json.dumps(tweet_object._json)
-        tweet_json = json.loads(json_str)
-        output_list.append(tweet_json)
-    return output_list
+def verifyTwitterCredentials():
+    '''
+    Cheap check (one call, no tweets or entities in the response) that the Twitter credentials work. Run it once at startup
+    Returns False if they're missing or Twitter turns them down (401). Any other failure (network blip, Twitter having a bad
+    moment) says nothing about the credentials, so that's logged and counts as OK - the jobs will find out soon enough
+    '''
 
-def tweetMostRecentPrice(ticker):
+    try:
+        user = twitterAuthenticate().verify_credentials(include_entities=False, skip_status=True)
+    except KeyError as e:
+        print(f"Twitter credentials check failed: {e} is not set")
+        return False
+    except tweepy.TweepError as e:
+        print(f"Couldn't check the Twitter credentials ({e}) - carrying on anyway")
+        return True
+
+    if not user:
+        print("Twitter credentials check failed: Twitter didn't accept them")
+        return False
+
+    print(f"Twitter credentials OK - tweeting as @{user.screen_name}")
+    return True
+
+def getDispatchApi(endpoint):
+    '''
+    Returns the API object the dispatcher sends to this endpoint with. It's separate from the one the jobs search with (and from
+    the other endpoints'), so the last response on it (where the rate limit headers come from) is always from its own last call
+    '''
 
-    # Authenticate Twitter
     api = twitterAuthenticate()
+    with _twitter_api_lock:
+        if endpoint not in _dispatch_apis:
+            _dispatch_apis[endpoint] = tweepy.API(api.auth)
 
-    # Get most recent price from the google sheet (function in moonwatch_utils module)
-    price = moon.getMostRecentPriceFromSheet(ticker)
-    emoji_for_tweet = emoji['rocket']
+        return _dispatch_apis[endpoint]
 
-    # Craft the tweet, filling in emoji unicode from dict (top of this file)
-    message = f"""$GME ${price} {emoji_for_tweet} #GME #wow #moon #HODL #Apestrong """
+def sendToTwitter(endpoint, func, *args, priority='default', description=None, **kwargs):
+    '''
+    Queues func(api, *args, **kwargs) on the dispatcher (see moonwatch_dispatch), so it goes out within Twitter's rate limits and in priority order
+    endpoint is the rate limit bucket ('tweet' for tweets & retweets, 'follow' for follows). Returns a Future with the result
+    '''
 
-    # Send the tweet (if during trading hours)
+    api = getDispatchApi(endpoint)
 
-    if moon.checkIfTradingHours():
-        response = api.update_status(status=message)
-        if response.text:
-            print(f"Successfully tweeted: {message}")
-        else: 
-            print("Something went wrong :()") 
+    # The dispatcher runs one send at a time per endpoint, so the API's last response is the one for this call
+    return dispatch.send(f'twitter:{endpoint}', func, api, *args, priority=priority, description=description or func.__name__,
+                         headers_of=lambda result: getattr(getattr(api, 'last_response', None), 'headers', None), **kwargs)
+
+def postStatus(api, message, media_ids=None):
+    '''
+    Runs on the dispatcher: posts the tweet
+    '''
 
+    if media_ids:
+        response = api.update_status(status=message, media_ids=media_ids)
     else:
-        print("We are outside trading hours... dont tweet, it will scare the children")
+        response = api.update_status(status=message)
+    print(f"Successfully tweeted: {message}")
+
+    return response
+
+def sendTweet(message, priority='default', media_ids=None):
+    '''
+    Queues a tweet. Returns a Future with the posted status
+    '''
+
+    return sendToTwitter('tweet', postStatus, message, media_ids=media_ids, priority=priority, description='Tweet')
+
+def shouldTweetPriceChange(event):
+    '''
+    Filter for the PriceChanged subscription: only during trading hours, and at most one price tweet per ticker every
+    PRICE_TWEET_MIN_MINUTES (prices can be checked a lot more often than that on volatile days, and we don't want to scare the children)
+    '''
+
+    if not moon.checkIfTradingHours():
+        return False
+
+    with _price_tweets_lock:
+        last_tweeted = _last_price_tweets.get(event.ticker)
+        if last_tweeted is not None and event.timestamp - last_tweeted < timedelta(minutes=PRICE_TWEET_MIN_MINUTES):
+            return False
+        _last_price_tweets[event.ticker] = event.timestamp
+
+    return True
+
+def tweetPriceChange(event):
+    '''
+    Subscriber for PriceChanged events: tweets the new price as soon as it's fetched
+    '''
+
+    # Craft the tweet, filling in emoji unicode from dict (top of this file)
+    message = f"""${event.ticker} ${event.price} {emoji['rocket']} #{event.ticker} #wow #moon #HODL #Apestrong """
+
+    sendTweet(message, priority='price')
 
 def retweetMostRecent(screen_name):
     '''
@@ -90,9 +203,7 @@ def retweetMostRecent(screen_name):
                                include_rts = False,
                                tweet_mode = 'extended'
                                )
-    most_recent_tweet = tweets[0]
-    json_str = json.dumps(most_recent_tweet._json)
-    tweet_json = json.loads(json_str)
+    tweet_json = tweets[0]._json
 
     # Only retweet if there have already been at least 200 retweets
     if tweet_json['retweet_count']<50:
@@ -100,153 +211,302 @@ def retweetMostRecent(screen_name):
         return
     else:
         print("Retweeting!! LFG")
+        sendToTwitter('tweet', retweetTweet, tweet_json, priority='retweet', description=f"Retweet of {tweet_json['id']}")
+
+
+def searchNewTweets(api, query, max_results=SEARCH_MAX_RESULTS, max_seconds=SEARCH_MAX_SECONDS):
+    '''
+    Yields tweets (as dicts) matching the query that are newer than anything the last search for this query saw, newest first
+    Pages are as big as Twitter allows, and the search stops after max_results tweets or max_seconds, whichever comes first
+    The newest tweet ID seen is saved as the query's since_id when the search is done, so the next run picks up from there
+    '''
+
+    since_id_key = f"twitter_since_id:{query}"
+    since_id = store.getStoreValue(since_id_key)
+    newest_id = since_id
+    started = datetime.now()
+
+    search_params = dict(q=query, count=SEARCH_PAGE_SIZE, result_type='recent', tweet_mode='compat')
+    if since_id is not None:
+        search_params['since_id'] = since_id
+
+    try:
+        for status in tweepy.Cursor(api.search, **search_params).items(max_results):
+            tweet = status._json
+            newest_id = max(newest_id or 0, tweet['id'])
+            yield tweet
+            if (datetime.now() - started).total_seconds() > max_seconds:
+                print(f"Search for '{query}' ran out of time - stopping here")
+                break
+    finally:
+        if newest_id != since_id:
+            store.setStoreValue(since_id_key, newest_id)
+
+def buildSearchQueries(queries):
+    '''
+    Dedupes the queries (ignoring case, like Twitter does) and ORs them together into as few searches as fit in Twitter's query length limit
+    '''
+
+    unique_queries = dict()
+    for query in queries:
+        unique_queries.setdefault(query.lower(), query)
+    unique_queries = list(unique_queries.values())
+
+    search_queries = []
+    for query in unique_queries:
+        if search_queries and len(search_queries[-1]) + len(" OR ") + len(query) <= MAX_QUERY_LENGTH:
+            search_queries[-1] += f" OR {query}"
+        else:
+            search_queries.append(query)
+
+    return search_queries
+
+def isRetweetCandidate(tweet):
+    '''
+    True if the tweet is something we'd retweet at all, however much engagement it has: not a reply, not a retweet, not one of ours
+    '''
+
+    return (tweet['in_reply_to_status_id'] == None
+            and 'retweeted_status' not in tweet.keys()
+            and not tweet.get('retweeted')
+            and not store.hasTwitterAction('retweet', tweet['id']))
+
+def hasEnoughEngagement(tweet, minimum_engagement):
+
+    return tweet['favorite_count'] > minimum_engagement and tweet['retweet_count'] > minimum_engagement
+
+def recheckTweets(api, watched, minimum_engagement, now=None):
+    '''
+    Looks the watched tweets up again (one statuses_lookup call per 100) and yields the ones that have picked up enough engagement
+    since they were last seen. Tweets that get yielded, were deleted or are older than RECHECK_HOURS are dropped from {watched}
+    (a dict of tweet ID -> [created_at, retweet_count], updated in place); the rest get their counts refreshed
+    '''
+
+    now = now or datetime.now(timezone.utc)
+    for id in list(watched):
+        created_at = datetime.strptime(watched[id][0], '%a %b %d %H:%M:%S %z %Y')
+        if (now - created_at).total_seconds() > RECHECK_HOURS * 3600:
+            del watched[id]
+
+    ids = list(watched)
+    for i in range(0, len(ids), RECHECK_LOOKUP_SIZE):
+        found = dict()
+        for status in api.statuses_lookup(ids[i:i+RECHECK_LOOKUP_SIZE], tweet_mode='compat'):
+            found[str(status._json['id'])] = status._json
+
+        for id in ids[i:i+RECHECK_LOOKUP_SIZE]:
+            tweet = found.get(id)
+            if tweet is None or not isRetweetCandidate(tweet):
+                del watched[id]
+            elif hasEnoughEngagement(tweet, minimum_engagement):
+                del watched[id]
+                yield tweet
+            else:
+                watched[id] = [tweet['created_at'], tweet['retweet_count']]
+
+def scanRetweetCandidates(api, queries, minimum_engagement):
+    '''
+    Searches every query in one go (see buildSearchQueries) and yields the tweets that are worth retweeting, as they come in
+    The search only sees tweets posted since the last one, so tweets that weren't good enough yet are kept on a short watch list
+    (the RECHECK_MAX_TWEETS most retweeted ones from the last RECHECK_HOURS) and looked up again on the next runs
+    '''
+
+    previously_watched = store.getStoreValue(RECHECK_KEY, dict())
+    newly_watched = dict()
+
+    try:
+        for query in buildSearchQueries(queries):
+            # Only tweets posted since the last search are scanned
+            for tweet in searchNewTweets(api, query):
+                if not isRetweetCandidate(tweet):
+                    continue
+                if hasEnoughEngagement(tweet, minimum_engagement):
+                    yield tweet
+                else:
+                    newly_watched[str(tweet['id'])] = [tweet['created_at'], tweet['retweet_count']]
+
+        # And the ones from earlier runs that might have taken off since
+        for id in newly_watched:
+            previously_watched.pop(id, None)
         try:
-            tweet_id = tweet_json['id']
-            api.retweet(tweet_id)
-            print("Retweet successful")
-        except:
-            print("Retweet failed (probably already retweeted it, dummy)")
+            yield from recheckTweets(api, previously_watched, minimum_engagement)
+        except tweepy.TweepError as e:
+            print(f"Couldn't recheck the watched tweets: {e}")
+    finally:
+        watched = {**previously_watched, **newly_watched}
+        most_retweeted = sorted(watched, key=lambda x: watched[x][1], reverse=True)[:RECHECK_MAX_TWEETS]
+        store.setStoreValue(RECHECK_KEY, {x: watched[x] for x in most_retweeted})
+
+def scoreTweet(tweet, now=None):
+    '''
+    Engagement score used to rank retweet candidates (see RETWEET_WEIGHT, LIKE_WEIGHT and RECENCY_HALF_LIFE_HOURS)
+    '''
 
+    score = tweet['retweet_count'] * RETWEET_WEIGHT + tweet['favorite_count'] * LIKE_WEIGHT
 
-def retweetHighEngagementTweet(query):
+    if RECENCY_HALF_LIFE_HOURS > 0:
+        now = now or datetime.now(timezone.utc)
+        created_at = datetime.strptime(tweet['created_at'], '%a %b %d %H:%M:%S %z %Y')
+        age_hours = max((now - created_at).total_seconds() / 3600, 0)
+        score = score * 0.5 ** (age_hours / RECENCY_HALF_LIFE_HOURS)
+
+    return score
+
+def rankTopTweets(tweets, k, score=scoreTweet):
+    '''
+    Returns the {k} best tweets by score (best first), deduped by tweet ID
+    Tweets are consumed one at a time and only the current top {k} are kept around, however many there are
+    '''
+
+    heap = [] # (score, tweet ID, tweet), worst of the top k first
+    ids_in_heap = set()
+
+    for tweet in tweets:
+        if tweet['id'] in ids_in_heap:
+            continue
+        entry = (score(tweet), tweet['id'], tweet)
+        if len(heap) < k:
+            heapq.heappush(heap, entry)
+            ids_in_heap.add(tweet['id'])
+        elif entry[:2] > heap[0][:2]:
+            dropped = heapq.heapreplace(heap, entry)
+            ids_in_heap.discard(dropped[1])
+            ids_in_heap.add(tweet['id'])
+
+    return [x[2] for x in sorted(heap, key=lambda x: x[:2], reverse=True)]
+
+def retweetAndFollow(tweet):
+    '''
+    Queues the retweet (which then queues a follow of whoever posted the tweet). Both are recorded in the ledger once they go through
+    Returns a Future that says whether the retweet happened
+    '''
+
+    return sendToTwitter('tweet', retweetTweet, tweet, priority='retweet', description=f"Retweet of {tweet['id']}")
+
+def retweetTweet(api, tweet):
     '''
-    This function runs periodically to look for a high-engagement tweet containing the search query.
-    It will retweet the top result that we have not already retweeted.
+    Runs on the dispatcher: retweets the tweet, unless it's been retweeted (or we've hit the daily cap) since it was queued
     '''
 
-    print(f"Executing retweetHighEngagementTweet('{query}')...")
+    tweet_id = tweet['id']
+    user_id = tweet['user']['id']
+
+    if store.hasTwitterAction('retweet', tweet_id):
+        print(f"Already retweeted {tweet_id}")
+        return False
+    if store.countTwitterActions('retweet', datetime.combine(date.today(), time())) >= DAILY_RETWEET_CAP:
+        print(f"Hit the daily retweet cap - not retweeting {tweet_id}")
+        return False
+
+    try:
+        api.retweet(tweet_id)
+    except tweepy.TweepError as e:
+        if e.api_code == ALREADY_RETWEETED:
+            store.recordTwitterAction('retweet', tweet_id, datetime.now())
+            print(f"Already retweeted {tweet_id}")
+            return False
+        raise
+
+    store.recordTwitterAction('retweet', tweet_id, datetime.now())
+    print(f"Successfully retweeted a high-engagement tweet (id {tweet_id})")
+
+    if store.hasTwitterAction('follow', user_id):
+        print(f"Already following user {user_id}")
+    else:
+        sendToTwitter('follow', followUser, user_id, priority='follow', description=f"Follow of {user_id}")
+
+    return True
+
+def followUser(api, user_id):
+    '''
+    Runs on the dispatcher: follows the user and records it in the ledger
+    '''
+
+    api.create_friendship(user_id = user_id)
+    store.recordTwitterAction('follow', user_id, datetime.now())
+    print(f"Successfully followed user {user_id}")
+
+def retweetHighEngagementTweets(queries=None, max_retweets=RETWEETS_PER_RUN):
+    '''
+    This function runs periodically to look for high-engagement tweets matching any of the queries (default: RETWEET_QUERIES).
+    It will retweet the top {max_retweets} results that we have not already retweeted, as long as we're under the daily cap
+    '''
+
+    queries = queries or RETWEET_QUERIES
+    print(f"Executing retweetHighEngagementTweets({queries})...")
+
+    # Forget retweets & follows that are too old to matter (search only goes back a week anyway)
+    store.pruneTwitterActions(datetime.now() - timedelta(days=LEDGER_RETENTION_DAYS))
+
+    retweets_today = store.countTwitterActions('retweet', datetime.combine(date.today(), time()))
+    max_retweets = min(max_retweets, DAILY_RETWEET_CAP - retweets_today)
+    if max_retweets <= 0:
+        print(f"Already retweeted {retweets_today} tweets today - that's enough")
+        return
 
     # Authenticate Twitter
     api = twitterAuthenticate()
 
-    # Get list of all my tweets
-    tweets = api.user_timeline(screen_name='MoonWatch_',count=1000,include_rts = True,tweet_mode = 'compat')
-    my_tweet_list = convertTweetResponseToDictList(tweets)
-    my_tweet_ids = [x['id'] for x in my_tweet_list]
-    
-    # Get recent tweets with hashtag #GME
-    GME_tweets_list = []
-    for page in tweepy.Cursor(api.search, q=query, count=1).pages():
-        tweets_in_this_page = convertTweetResponseToDictList(page)
-        GME_tweets_list.append(tweets_in_this_page)
-        
-    GME_tweets_list = list(itertools.chain.from_iterable(GME_tweets_list))     
-    
     # Use stricter limits for retweeting during business hours
     if moon.checkIfTradingHours():
         minimum_engagement = 100
     else:
         minimum_engagement = 10        
 
-    # Get the set of tweets that have high enough engagement for us to want to retweet
-    high_engagement_tweets = [x for x in GME_tweets_list 
-                              if x['in_reply_to_status_id'] == None
-                              and x['favorite_count'] > minimum_engagement
-                              and x['retweet_count'] > minimum_engagement 
-                              and 'retweeted_status' not in x.keys()
-                              and x not in my_tweet_ids]
-    
-    # If there are any recent tweets with high enough engagement, retweet the one with the most "likes"
-    if len(high_engagement_tweets)>0:
-        # From the resulting dataframe, isolate the tweet id of the most retweeted high-engagement tweet
-        top_tweet = pd.DataFrame(high_engagement_tweets).sort_values('retweet_count',ascending=False).reset_index().loc[0:0]
-        tweet_id_to_retweet = top_tweet['id'][0]
-
-        user_id = my_tweet_list[0]['user']['id']
+    # Keep only the best few candidates as the search streams in
+    top_tweets = rankTopTweets(scanRetweetCandidates(api, queries, minimum_engagement), max_retweets)
 
-        try:
-            api.retweet(tweet_id_to_retweet)
-            print(f"Successfully retweeted a high-engagement tweet (id {tweet_id_to_retweet})")
-            try: #Follow the account that posted the tweet we are retweeting
-                api.create_friendship(user_id)
-                print(f"Successfully followed user {user_id}")
-            except:
-                print("Follow failed (probably already following this account)")
-        except:
-            print("Retweet failed") 
+    # If there are any recent tweets with high enough engagement, retweet them
+    if len(top_tweets)>0:
+        for tweet in top_tweets:
+            retweetAndFollow(tweet)
     else:
         print("No recent tweets are good enough to retweet. Oh well")
 
+def retweetHighEngagementTweet(query):
+    '''
+    Same as retweetHighEngagementTweets, for a single query
+    '''
 
+    retweetHighEngagementTweets([query])
 
-def tweetTrendImage(ticker):
 
-    # Authenticate Twitter
-    api = twitterAuthenticate()
 
-    if moon.checkIfTradingHours():
-        # Use Selenium to save a screenshot
-        print("Using Selenium to fetch a screenshot")
-        filename = moon.getScreenshot(ticker)
+def tweetTrendImage(ticker):
 
-        # Crop the screenshot to show only the cute trend chart
-        print(f"Screenshot saved: {filename}. Cropping image and uploading to Twitter...")
-        moon.cropImage(filename)
-        try:
-            media = api.media_upload(filename)
-            tweet = f"Your regularly scheduled update {emoji['rocket']}"
-            response = api.update_status(status=tweet, media_ids=[media.media_id])
-            print("Trend image tweeted successfully")
-        except: 
-            print("Trend image failed to tweet :(")
+    # Runs midday and again after the close (the post-close runs on both channels share the closing image, see moonwatch_images)
+    if moon.checkIfTradingDay():
+        # Rendered once per slot and shared with the Slack app
+        image = images.getTrendImage(ticker)
+        tweet = f"Your regularly scheduled update {emoji['rocket']}"
+        sendToTwitter('tweet', tweetImage, image, tweet, priority='trend', description=f"{ticker} trend image tweet")
     else:
-        print("We are outside trading hours - chill")
+        print("No trend images on non-trading days!")
+
+def tweetImage(api, image, message):
+    '''
+    Runs on the dispatcher: uploads the image (unless it's already on Twitter) and tweets it
+    '''
+
+    media_id = images.getUpload(image, 'twitter', lambda x: api.media_upload(x.name, file=BytesIO(x.data)).media_id)
+    response = api.update_status(status=message, media_ids=[media_id])
+    print("Trend image tweeted successfully")
 
+    return response
 
 
-def tweetEODSummary(ticker):
+
+def tweetEODSummary(tickers=None):
     '''
-    For a given ticker, tweet a summary of the day's trading stats
+    For each ticker on the watchlist (or the given tickers), tweet a summary of the day's trading stats
     This will be scheduled to run at the end of every trading day
     '''
 
-    # Authenticate Twitter
-    api = twitterAuthenticate()
-    
-    # Load the worksheet as a dataframe
-    worksheet_key = os.getenv("MOONWATCH_WORKSHEET_KEY")
-    sheet_index = int(os.environ['HISTORICAL_DATA_SHEET_INDEX'])
-    summary_df = moon.loadGoogleSheetAsDF(worksheet_key, sheet_index)
-        
-    # Filter summary to selected ticker & today's date
-    today = str(date.today())
-    today_summary = summary_df[(summary_df['Date']==today) & (summary_df['Ticker']==ticker)].reset_index() #reset index so that [0] always works
-    
-    # Extract metrics from the summary table
-    trading_open = round(today_summary['open'][0],2)
-    trading_close = round(today_summary['close'][0],2)
-    trading_volume = today_summary['volume'][0]
-    trading_volume_rank = today_summary['volume_rank'][0]
-    
-    trading_intraday_delta = today_summary['Intraday Price Change (Dollars)'][0]
-    trading_intraday_delta_pct = today_summary['Intraday Price Change (Percentage)'][0]
-    trading_intraday_delta_pct = str(round(trading_intraday_delta_pct*100,1))+"%"
-    trading_close_vs_prior_day_pct = today_summary['Closing Price Delta from Prior Day (Percentage)'][0]
-    trading_close_vs_prior_day_pct = str(round(trading_close_vs_prior_day_pct*100,1))+"%"
-    
-    if trading_intraday_delta>0:
-        trading_intraday_delta_direction='Up'
-    else:
-        trading_intraday_delta_direction='Down'
-        
-    # Craft a beautiful and helpful Slack message
-    EOD_summary_message = f'''
-    Hello apes! What a day it has been!!!
-    
-    Today ({today}), $GME opened at ${trading_open} and closed at ${trading_close} ({trading_intraday_delta_direction} {trading_intraday_delta_pct} from open)
-
-    Today's trading volume: {trading_volume} (rank #{trading_volume_rank} across the past year of trading)
-    
-    Don't forget to #HODL! #GME #MOASS #Apestrong
-    '''
-    
-    # Tweet the EOD summary    
-    if moon.checkIfTradingHours():
-        response = api.update_status(status=EOD_summary_message)
-        if response.text:
-            print(f"Successfully tweeted EOD summary")
-        else: 
-            print("Something went wrong, EOD summary failed to tweet :()") 
-    else:
+    if not moon.checkIfTradingDay():
         print("No EOD summary on non-trading days!") 
-        return
\ No newline at end of file
+        return
+
+    # The summaries are shared with the Slack app, so whoever asks first does the loading
+    for ticker, eod_summary in summary.getEODSummaries(tickers).items():
+        print(f"Sending {ticker} EOD summary tweet")
+        sendTweet(summary.renderTweetEODMessage(eod_summary), priority='eod') 